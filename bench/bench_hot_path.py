@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+每条消息热路径的微基准测试
+覆盖 is_user_allowed、check_rate_limit、extract_trigger_from_message、parse_task_message
+（有/无会话记忆）、validate_task_input、filter_sensitive_info 与 parse_cursor_output，
+使用 10 / 1k / 10k 规模的合成用户、触发词与会话数据。
+
+用法：
+    python3 bench/bench_hot_path.py --save-baseline bench/baseline.json
+    python3 bench/bench_hot_path.py --compare bench/baseline.json --tolerance 0.25
+
+每个用例与固定的参考负载交替计时，比较的是“用例耗时 / 参考负载耗时”的多轮中位数，
+以抵消机器整体速度的漂移（虚拟机 CPU 争用、降频等）。与基线相比任一用例变慢超过容差时
+以退出码 1 结束；每次调用都重新读取并解析 JSON 文件的用例（I/O 型）波动较大，使用更宽的 --io-tolerance。
+"""
+
+import os
+import sys
+import json
+import time
+import timeit
+import logging
+import argparse
+import tempfile
+import statistics
+import importlib.util
+
+BOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../bot")
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+SIZES = (10, 1000, 10000)
+
+
+def load_bot_module(workdir):
+    """以隔离的配置/数据目录加载 telegram-bot.py（不写入仓库内的日志与数据文件）"""
+    sys.path.insert(0, BOT_DIR)
+    # 先配置 root logger，使 bot 模块中的 basicConfig 不再创建日志文件
+    logging.basicConfig(level=logging.CRITICAL, handlers=[logging.NullHandler()])
+
+    import session_manager
+    session_manager.DATA_DIR = workdir
+    session_manager.SESSION_FILE = os.path.join(workdir, "user_sessions.json")
+
+    spec = importlib.util.spec_from_file_location("telegram_bot", os.path.join(BOT_DIR, "telegram-bot.py"))
+    bot = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bot)
+    return bot, session_manager
+
+
+def write_synthetic_data(workdir, size):
+    """
+    生成 size 个用户、触发词与会话
+
+    Returns:
+        dict: config_file / session_file / trigger_mapping / user_ids / last_trigger
+    """
+    user_ids = list(range(100000, 100000 + size))
+    config = {
+        "allowed_user_ids": user_ids,
+        "admin_user_id": user_ids[0],
+        "allowed_projects": {f"project-{i}": f"/srv/projects/project-{i}" for i in range(size)}
+    }
+    config_file = os.path.join(workdir, f"bot_config_{size}.json")
+    with open(config_file, 'w', encoding='utf-8') as f:
+        json.dump(config, f)
+
+    today = time.strftime("%Y-%m-%d")
+    sessions = {
+        str(user_id): {"project_path": f"/srv/projects/project-{i}", "trigger_word": f"trigger-{i}", "date": today}
+        for i, user_id in enumerate(user_ids)
+    }
+    session_file = os.path.join(workdir, f"user_sessions_{size}.json")
+    with open(session_file, 'w', encoding='utf-8') as f:
+        json.dump(sessions, f)
+
+    return {
+        "config_file": config_file,
+        "session_file": session_file,
+        "trigger_mapping": {f"trigger-{i}": f"/srv/projects/project-{i}" for i in range(size)},
+        "user_ids": user_ids,
+        "last_trigger": f"trigger-{size - 1}"
+    }
+
+
+def make_text(size_bytes):
+    chunk = "Updated src/module.py: refactor handler, key sk-" + "A" * 40 + " and plain log line.\n"
+    return (chunk * (size_bytes // len(chunk) + 1))[:size_bytes]
+
+
+def make_transcript(lines):
+    records = [
+        json.dumps({"type": "assistant", "message": {"content": [{"type": "text", "text": f"step {i}: editing file"}]}})
+        for i in range(lines)
+    ]
+    records.append(json.dumps({
+        "type": "result",
+        "is_error": False,
+        "result": "done",
+        "duration_ms": 12345,
+        "duration_api_ms": 10000
+    }))
+    return "\n".join(records)
+
+
+def reference_workload():
+    """与被测代码同类的纯 Python 负载（字典、JSON、字符串、排序），用于换算机器速度"""
+    data = {f"key-{i}": [i, str(i), i * 0.5] for i in range(200)}
+    json.loads(json.dumps(data))
+    sorted(data, key=lambda key: key[::-1])
+
+
+def _calibrate(timer, min_time):
+    number, elapsed = timer.autorange()
+    while elapsed < min_time:
+        number *= 2
+        elapsed = timer.timeit(number)
+    return number
+
+
+def measure(func, min_time, repeat):
+    """
+    与参考负载交替计时 repeat 轮
+
+    Returns:
+        tuple: (单次调用耗时的中位数（秒）, 相对参考负载耗时之比的中位数)
+    """
+    timer = timeit.Timer(func)
+    reference = timeit.Timer(reference_workload)
+    number = _calibrate(timer, min_time)
+    reference_number = _calibrate(reference, min_time / 4)
+    seconds, relative = [], []
+    for _ in range(repeat):
+        reference_seconds = reference.timeit(reference_number) / reference_number
+        elapsed = timer.timeit(number) / number
+        seconds.append(elapsed)
+        relative.append(elapsed / reference_seconds)
+    return statistics.median(seconds), statistics.median(relative)
+
+
+def build_cases(bot, session_manager, workdir):
+    """
+    构造 {用例名: (setup, 无参函数, 是否为 I/O 型)}（数据准备在用例函数外完成）
+
+    is_user_allowed 与 parse_task_message 每次调用都会重新读取配置/会话文件，属于 I/O 型
+    """
+    cases = {}
+    task_text = "为登录接口增加参数校验并补充单元测试 --model auto " + "细节说明 " * 60
+
+    for size in SIZES:
+        data = write_synthetic_data(workdir, size)
+        user_ids = data["user_ids"]
+        last_user = user_ids[-1]
+
+        def setup(data=data):
+            # 每个规模使用自己的配置文件、会话文件与触发词映射
+            bot.CONFIG_FILE = data["config_file"]
+            session_manager.SESSION_FILE = data["session_file"]
+            bot.trigger_mapping = data["trigger_mapping"]
+
+        user_cycle = iter(range(10 ** 9))
+
+        def rate_limit(user_ids=user_ids, user_cycle=user_cycle):
+            # 轮换用户，避免一直命中限流分支
+            user_id = user_ids[next(user_cycle) % len(user_ids)]
+            if not bot.check_rate_limit(user_id):
+                bot.user_message_times[user_id].clear()
+
+        cases[f"is_user_allowed[{size}]"] = (setup, lambda last_user=last_user: bot.is_user_allowed(last_user), True)
+        cases[f"check_rate_limit[{size}]"] = (setup, rate_limit, False)
+        cases[f"extract_trigger_from_message[{size}]"] = (
+            setup, lambda t=f"切换到{data['last_trigger']}": bot.extract_trigger_from_message(t, bot.trigger_mapping), False
+        )
+        cases[f"parse_task_message[{size}]"] = (setup, lambda: bot.parse_task_message(task_text), True)
+        cases[f"parse_task_message_session[{size}]"] = (
+            setup, lambda last_user=last_user: bot.parse_task_message(task_text, last_user), True
+        )
+
+    validate_text = ("检查日志输出格式并修复 " * 40)[:900]
+    cases["validate_task_input"] = (None, lambda: bot.validate_task_input(validate_text), False)
+
+    for label, size_bytes in (("1KB", 1024), ("100KB", 100 * 1024), ("10MB", 10 * 1024 * 1024)):
+        text = make_text(size_bytes)
+        cases[f"filter_sensitive_info[{label}]"] = (None, lambda text=text: bot.filter_sensitive_info(text), False)
+
+    for lines in (1000, 100000):
+        transcript = make_transcript(lines)
+        cases[f"parse_cursor_output[{lines}]"] = (None, lambda t=transcript: bot.parse_cursor_output(t), False)
+
+    return cases
+
+
+def format_seconds(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f}{unit}"
+    return f"{seconds / 1e-9:.0f}ns"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-message hot path microbenchmarks")
+    parser.add_argument("--save-baseline", metavar="PATH", nargs="?", const=DEFAULT_BASELINE,
+                        help="保存结果为基线 JSON（默认 bench/baseline.json）")
+    parser.add_argument("--compare", metavar="PATH", nargs="?", const=DEFAULT_BASELINE,
+                        help="与基线 JSON 比较，变慢超过容差时退出码为 1")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="允许的变慢比例（默认 0.25）")
+    parser.add_argument("--io-tolerance", type=float, default=0.6,
+                        help="I/O 型用例（每次调用读取并解析 JSON 文件）允许的变慢比例（默认 0.6）")
+    parser.add_argument("--repeat", type=int, default=9, help="每个用例的计时轮数，取中位数（默认 9）")
+    parser.add_argument("--filter", default="", help="只运行名称包含此字符串的用例")
+    parser.add_argument("--min-time", type=float, default=0.2, help="每轮最短计时秒数（默认 0.2）")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        bot, session_manager = load_bot_module(workdir)
+        cases = build_cases(bot, session_manager, workdir)
+        results = {}
+        relative = {}
+        io_bound = set()
+        for name, (setup, func, is_io) in cases.items():
+            if args.filter not in name:
+                continue
+            if setup:
+                setup()
+            if is_io:
+                io_bound.add(name)
+            results[name], relative[name] = measure(func, args.min_time, args.repeat)
+            print(f"{name:45s} {format_seconds(results[name]):>10s}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(
+                {"python": sys.version.split()[0], "results": results, "relative": relative},
+                f, indent=2, sort_keys=True
+            )
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        # 旧基线没有 relative 时退回比较绝对耗时
+        current = relative if "relative" in baseline else results
+        baseline = baseline.get("relative") or baseline["results"]
+        regressions = []
+        print(f"\nCompared with {args.compare} (tolerance {args.tolerance:.0%}, I/O-bound {args.io_tolerance:.0%}):")
+        for name, value in current.items():
+            if name not in baseline:
+                continue
+            ratio = value / baseline[name]
+            tolerance = args.io_tolerance if name in io_bound else args.tolerance
+            marker = "REGRESSION" if ratio > 1 + tolerance else ""
+            print(f"{name:45s} {ratio:6.2f}x {marker}")
+            if marker:
+                regressions.append(name)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+任务准入控制模块
+在任务进入调度队列前去重与限流：
+- 同一用户、同一项目、相同描述的任务在时间窗口内重复提交时，合并到正在执行的任务
+- 队列长度超过高水位时提前拒绝，并给出预计等待时间
+"""
+
+import re
+import time
+import asyncio
+import logging
+
+import task_scheduler
+
+# 默认准入配置（可被 config/bot_config.json 的 admission 段覆盖）
+DEFAULT_ADMISSION_CONFIG = {
+    "dedup_window_seconds": 120,
+    "queue_high_water": 10,
+    "default_task_seconds": 120
+}
+
+# 正在排队或执行中的任务：key -> entry
+_inflight = {}
+
+
+def get_admission_settings(config):
+    """合并默认值与配置中的 admission 段"""
+    settings = dict(DEFAULT_ADMISSION_CONFIG)
+    settings.update(config.get("admission") or {})
+    return settings
+
+
+def task_key(user_id, task):
+    """
+    生成用于去重的任务键（忽略大小写与多余空白）
+
+    Args:
+        user_id: 用户ID
+        task: parse_task_message 返回的任务字典
+
+    Returns:
+        tuple: (user_id, project_path, model, normalized_description)
+    """
+    description = re.sub(r'\s+', ' ', task["description"]).strip().lower()
+    return (user_id, task["projectPath"], task["model"], description)
+
+
+def find_duplicate(key, config):
+    """
+    查找时间窗口内提交、仍在排队或执行中的相同任务
+
+    Returns:
+        dict: 已存在的任务条目；没有时返回 None
+    """
+    entry = _inflight.get(key)
+    if not entry or entry["future"].done():
+        return None
+    window = get_admission_settings(config)["dedup_window_seconds"]
+    if time.monotonic() - entry["submitted_at"] > window:
+        return None
+    return entry
+
+
+def register(key):
+    """
+    登记一个新任务，供后续重复提交合并
+
+    Returns:
+        dict: 任务条目，任务结束时需调用 complete()
+    """
+    entry = {
+        "key": key,
+        "submitted_at": time.monotonic(),
+        "future": asyncio.get_running_loop().create_future(),
+        "merged": 0
+    }
+    _inflight[key] = entry
+    return entry
+
+
+def complete(entry, response):
+    """
+    任务结束：把最终回复交给所有合并进来的请求
+
+    Args:
+        entry: register() 返回的条目
+        response: 最终回复文本（任务异常结束时为 None）
+    """
+    if not entry["future"].done():
+        entry["future"].set_result(response)
+    if _inflight.get(entry["key"]) is entry:
+        del _inflight[entry["key"]]
+
+
+async def wait_for_merged(entry):
+    """
+    合并到已有任务并等待其结果
+
+    Returns:
+        str: 原任务的最终回复；原任务异常结束时返回 None
+    """
+    entry["merged"] += 1
+    logging.info(f"Merged duplicate submission into in-flight task (merged={entry['merged']})")
+    return await asyncio.shield(entry["future"])
+
+
+def estimate_wait_seconds(default_task_seconds):
+    """根据当前排队/执行数量与历史平均执行时长估算新任务的等待时间"""
+    stats = task_scheduler.get_scheduler_stats()
+    completed = sum(u["completed"] for u in stats["users"].values())
+    service_total = sum(u["service_total"] for u in stats["users"].values())
+    average = service_total / completed if completed else default_task_seconds
+    pending = stats["queued"] + stats["running"] + stats["suspended"]
+    return pending * average / max(stats["capacity"], 1)
+
+
+def check_backpressure(config, incoming=1):
+    """
+    检查队列是否超过高水位
+
+    Args:
+        config: load_config() 返回的配置字典
+        incoming: 本次要提交的任务数（批量任务为子任务数）
+
+    Returns:
+        int: 超过高水位时返回预计等待分钟数；允许提交时返回 None
+    """
+    settings = get_admission_settings(config)
+    queued = task_scheduler.get_scheduler_stats()["queued"]
+    if queued + incoming <= settings["queue_high_water"]:
+        return None
+    wait_minutes = max(1, round(estimate_wait_seconds(settings["default_task_seconds"]) / 60))
+    logging.warning(f"Queue over high-water mark ({queued} queued), rejecting new work (~{wait_minutes} min wait)")
+    return wait_minutes
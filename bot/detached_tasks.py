@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+脱离 Bot 进程运行的 agent 任务
+每个任务通过 task_supervisor.py 在独立会话中启动，输出写入 data/tasks/<id>/ 下的文件，
+并记录一份状态文件（进程、聊天、已推送的输出偏移等）。Bot 重启后据此重新接管
+仍在运行或已结束但结果尚未送达的任务，从上次的偏移继续推送输出并发送最终结果。
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import logging
+import subprocess
+from threading import Lock
+
+# 数据文件路径
+DATA_DIR = os.path.join(os.path.dirname(__file__), "../data")
+TASKS_DIR = os.path.join(DATA_DIR, "tasks")
+SUPERVISOR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "task_supervisor.py")
+
+STATE_FILE_NAME = "state.json"
+EXIT_FILE_NAME = "exit.json"
+OUTPUT_FILE_NAMES = {"stdout": "stdout.log", "stderr": "stderr.log"}
+
+# 文件锁，用于多线程安全
+_file_lock = Lock()
+
+
+def _task_dir(task_id):
+    return os.path.join(TASKS_DIR, task_id)
+
+
+def _write_json(path, data):
+    tmp_file = path + ".tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_file, path)
+
+
+def save_state(task):
+    """原子写入任务状态文件"""
+    try:
+        with _file_lock:
+            _write_json(os.path.join(_task_dir(task["task_id"]), STATE_FILE_NAME), task)
+    except (IOError, OSError) as e:
+        logging.error(f"Failed to save state for task {task['task_id']}: {e}")
+
+
+def spawn_task(task_id, cmd, cwd, env, limits, state):
+    """
+    通过监管进程在独立会话中启动 agent，输出写入任务目录
+
+    Args:
+        task_id: 任务唯一标识
+        cmd: agent 命令（参数列表）
+        cwd: 工作目录（None 表示当前目录）
+        env: 环境变量
+        limits: 资源限制 {"memory_mb", "cpu_seconds", "cgroup_path"}，由监管进程施加于自身并被 agent 继承
+        state: 需要随任务持久化的信息（chat_id、user_id、project_path 等）
+
+    Returns:
+        tuple: (process, task)，process 为监管进程的 Popen 对象，task 为任务状态字典
+    """
+    task_dir = _task_dir(task_id)
+    os.makedirs(task_dir, exist_ok=True)
+    stdout_file = open(os.path.join(task_dir, OUTPUT_FILE_NAMES["stdout"]), 'wb')
+    stderr_file = open(os.path.join(task_dir, OUTPUT_FILE_NAMES["stderr"]), 'wb')
+    try:
+        process = subprocess.Popen(
+            [sys.executable, SUPERVISOR_PATH, task_dir, "--limits", json.dumps(limits or {}), "--"] + cmd,
+            cwd=cwd,
+            stdin=subprocess.DEVNULL,
+            stdout=stdout_file,
+            stderr=stderr_file,
+            env=env,
+            start_new_session=(os.name == "posix")
+        )
+    except OSError:
+        shutil.rmtree(task_dir, ignore_errors=True)
+        raise
+    finally:
+        # 子进程已持有文件描述符，Bot 只按偏移读取文件
+        stdout_file.close()
+        stderr_file.close()
+
+    task = dict(state)
+    task.update({
+        "task_id": task_id,
+        "pid": process.pid,
+        "pgid": _getpgid(process.pid),
+        "started_at": time.time(),
+        "stdout_offset": 0,
+        "stderr_offset": 0
+    })
+    save_state(task)
+    logging.info(f"Started detached task {task_id} (supervisor pid {process.pid})")
+    return process, task
+
+
+def _getpgid(pid):
+    try:
+        return os.getpgid(pid)
+    except (AttributeError, ProcessLookupError):
+        return None
+
+
+def read_new_output(task, name):
+    """
+    读取自上次偏移以来新增的完整行，并推进偏移（调用方负责 save_state）
+
+    Args:
+        task: 任务状态字典
+        name: "stdout" 或 "stderr"
+
+    Returns:
+        str: 新增输出；没有完整的新行时返回空字符串
+    """
+    offset_key = f"{name}_offset"
+    try:
+        with open(os.path.join(_task_dir(task["task_id"]), OUTPUT_FILE_NAMES[name]), 'rb') as f:
+            f.seek(task[offset_key])
+            data = f.read()
+    except OSError as e:
+        logging.warning(f"Failed to read {name} of task {task['task_id']}: {e}")
+        return ""
+    # 只消费到最后一个换行，避免截断尚未写完的行或多字节字符
+    end = data.rfind(b"\n") + 1
+    task[offset_key] += end
+    return data[:end].decode("utf-8", errors="replace")
+
+
+def read_output(task, name):
+    """读取任务的全部 stdout / stderr"""
+    try:
+        with open(os.path.join(_task_dir(task["task_id"]), OUTPUT_FILE_NAMES[name]), 'rb') as f:
+            return f.read().decode("utf-8", errors="replace")
+    except OSError:
+        return ""
+
+
+def _read_exit_status(task):
+    exit_file = os.path.join(_task_dir(task["task_id"]), EXIT_FILE_NAME)
+    try:
+        with open(exit_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def _is_alive(task):
+    """监管进程是否仍在运行（进程组不一致时视为 PID 已被复用）"""
+    try:
+        os.kill(task["pid"], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    pgid = _getpgid(task["pid"])
+    return task.get("pgid") is None or pgid == task["pgid"]
+
+
+def poll_task(task, process=None):
+    """
+    检查任务是否结束
+
+    Args:
+        task: 任务状态字典
+        process: 本次启动时的监管进程 Popen 对象；重启后接管的任务为 None
+
+    Returns:
+        tuple: (returncode, usage)；仍在运行时 returncode 为 None。
+               监管进程异常退出、未记录退出状态时 returncode 为 -1
+    """
+    if process is not None:
+        if process.poll() is None:
+            return None, None
+        status = _read_exit_status(task)
+        if status is None:
+            logging.warning(f"Supervisor of task {task['task_id']} exited with {process.returncode} without exit status")
+            return process.returncode or -1, None
+        return status["code"], status.get("usage")
+
+    status = _read_exit_status(task)
+    if status is not None:
+        return status["code"], status.get("usage")
+    if _is_alive(task):
+        return None, None
+    # 监管进程可能在两次检查之间刚写完退出状态
+    status = _read_exit_status(task)
+    if status is not None:
+        return status["code"], status.get("usage")
+    logging.warning(f"Supervisor of task {task['task_id']} is gone without exit status")
+    return -1, None
+
+
+def resume_process_group(task):
+    """向任务进程组发送 SIGCONT（重启前被抢占暂停的任务不会再有调度器来恢复）"""
+    if not task.get("pgid") or not hasattr(signal, "SIGCONT"):
+        return
+    try:
+        os.killpg(task["pgid"], signal.SIGCONT)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def load_pending_tasks():
+    """
+    读取所有尚未回复结果的任务（Bot 启动时调用）
+
+    Returns:
+        list: 任务状态字典列表，按启动时间排序
+    """
+    if not os.path.isdir(TASKS_DIR):
+        return []
+    tasks = []
+    for task_id in os.listdir(TASKS_DIR):
+        state_file = os.path.join(_task_dir(task_id), STATE_FILE_NAME)
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                tasks.append(json.load(f))
+        except (OSError, json.JSONDecodeError) as e:
+            logging.warning(f"Discarding unreadable task directory {task_id}: {e}")
+            shutil.rmtree(_task_dir(task_id), ignore_errors=True)
+    return sorted(tasks, key=lambda task: task.get("started_at", 0))
+
+
+def remove_task(task_id):
+    """结果送达用户后删除任务目录"""
+    shutil.rmtree(_task_dir(task_id), ignore_errors=True)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+任务耗时预测模块
+根据历史任务按（项目, 模型, 任务规模）统计耗时分位数，用于显示预计完成时间、
+按预测安排进度推送的频率，并标记超过 p99 的疑似卡住任务。
+"""
+
+import logging
+from collections import defaultdict, deque
+
+import model_router
+
+# 每个统计键保留的样本数
+MAX_SAMPLES = 200
+
+# 至少有这么多样本才给出预测
+MIN_SAMPLES = 5
+
+# 进度推送间隔（秒）
+BASE_PROGRESS_INTERVAL = 30
+NEAR_END_PROGRESS_INTERVAL = 10
+MAX_PROGRESS_INTERVAL = 120
+
+# 通配键
+_ANY = "*"
+
+_samples = defaultdict(lambda: deque(maxlen=MAX_SAMPLES))
+
+
+def record(project_path, model, bucket, seconds):
+    """
+    记录一次任务耗时
+
+    Args:
+        project_path: 项目路径
+        model: 使用的模型
+        bucket: model_router.size_bucket() 的结果
+        seconds: 任务耗时（秒，不含暂停时长）
+    """
+    if seconds is None or seconds <= 0:
+        return
+    for key in _keys(project_path, model, bucket):
+        _samples[key].append(seconds)
+
+
+def _keys(project_path, model, bucket):
+    # 由精确到宽泛，数据不足时逐级回退
+    return [
+        (project_path, model, bucket),
+        (project_path, model, _ANY),
+        (project_path, _ANY, _ANY),
+        (_ANY, _ANY, _ANY)
+    ]
+
+
+def warm_up(records):
+    """用任务历史预热耗时样本"""
+    for item in records:
+        bucket = item.get("size_bucket") or model_router.size_bucket(item.get("description", ""))
+        record(item.get("project_path", ""), item.get("model", ""), bucket, item.get("wall_seconds"))
+    logging.info(f"ETA predictor warmed up with {len(records)} historical tasks")
+
+
+def _quantile(sorted_values, q):
+    position = (len(sorted_values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def predict(project_path, model, description):
+    """
+    预测任务耗时
+
+    Returns:
+        dict: p50 / p90 / p99（秒）与样本数；样本不足时返回 None
+    """
+    bucket = model_router.size_bucket(description)
+    for key in _keys(project_path, model, bucket):
+        samples = _samples.get(key)
+        if samples and len(samples) >= MIN_SAMPLES:
+            values = sorted(samples)
+            return {
+                "p50": _quantile(values, 0.5),
+                "p90": _quantile(values, 0.9),
+                "p99": _quantile(values, 0.99),
+                "count": len(values)
+            }
+    return None
+
+
+def _format_duration(seconds):
+    if seconds < 60:
+        return f"{seconds:.0f}s"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f}m"
+    return f"{seconds / 3600:.1f}h"
+
+
+def format_eta(prediction):
+    """
+    格式化预测结果
+
+    Returns:
+        str: 例如 "ETA ~3m (p90 7m)"；无预测时返回空字符串
+    """
+    if not prediction:
+        return ""
+    return f"ETA ~{_format_duration(prediction['p50'])} (p90 {_format_duration(prediction['p90'])})"
+
+
+def next_progress_interval(elapsed, prediction):
+    """
+    根据已执行时间与预测计算下一次进度推送的间隔
+
+    接近预计结束（p50 的 75% 到 p90 之间）时频繁推送，长时间执行的中段稀疏推送。
+
+    Returns:
+        float: 间隔秒数
+    """
+    if not prediction:
+        return BASE_PROGRESS_INTERVAL
+    near_end_start = prediction["p50"] * 0.75
+    if near_end_start <= elapsed <= prediction["p90"]:
+        return NEAR_END_PROGRESS_INTERVAL
+    if elapsed < near_end_start:
+        # 间隔不超过剩余时间的一半，保证进入结束窗口时能及时推送
+        return min(max((near_end_start - elapsed) / 2, NEAR_END_PROGRESS_INTERVAL), MAX_PROGRESS_INTERVAL)
+    return BASE_PROGRESS_INTERVAL
+
+
+def is_overdue(elapsed, prediction):
+    """任务已执行时间是否超过历史 p99"""
+    return bool(prediction) and elapsed > prediction["p99"]
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+依赖健康探测与熔断模块
+后台定期探测 agent 使用的代理是否可连接、agent 可执行文件是否存在并能响应 --version、
+Telegram API 是否可达。连续失败达到阈值（或 agent 启动失败）时熔断，
+熔断期间任务立即失败并给出明确原因；探测恢复通过后自动解除。
+"""
+
+import time
+import socket
+import shutil
+import logging
+import threading
+import subprocess
+from urllib.parse import urlparse
+
+# 默认健康检查配置（可被 config/bot_config.json 的 health 段覆盖）
+DEFAULT_HEALTH_CONFIG = {
+    "probe_interval_seconds": 30,
+    "open_probe_interval_seconds": 10,
+    "probe_timeout_seconds": 5,
+    "failure_threshold": 2
+}
+
+TELEGRAM_API_HOST = "api.telegram.org"
+TELEGRAM_API_PORT = 443
+
+# 熔断时会使任务立即失败的依赖（Telegram 不可达时无法回复，只做展示）
+TASK_DEPENDENCIES = ("proxy", "agent")
+
+_DEPENDENCY_NAMES = {"proxy": "代理", "agent": "agent", "telegram": "Telegram API"}
+
+_settings = dict(DEFAULT_HEALTH_CONFIG)
+_targets = {}  # 依赖 -> 探测目标描述（用于展示）
+_state = {}  # 依赖 -> {"open", "failures", "detail", "latency_ms", "checked_at", "opened_at"}
+_state_lock = threading.Lock()
+_wakeup = threading.Event()
+
+
+def _new_state():
+    return {"open": False, "failures": 0, "detail": "", "latency_ms": None, "checked_at": None, "opened_at": None}
+
+
+def _parse_host_port(url, default_port):
+    parsed = urlparse(url if "://" in url else f"http://{url}")
+    return parsed.hostname, parsed.port or default_port
+
+
+# ---------- 探测 ----------
+
+def probe_proxy(proxy_url, timeout):
+    """代理端口能否建立 TCP 连接"""
+    host, port = _parse_host_port(proxy_url, 80)
+    with socket.create_connection((host, port), timeout=timeout):
+        pass
+
+
+def probe_agent(agent_path, timeout):
+    """agent 可执行文件是否存在并能响应 --version"""
+    resolved = shutil.which(agent_path)
+    if resolved is None:
+        raise RuntimeError(f"找不到 agent 可执行文件：{agent_path}")
+    result = subprocess.run([resolved, "--version"], capture_output=True, text=True, timeout=timeout)
+    if result.returncode != 0:
+        raise RuntimeError(f"agent --version 退出码 {result.returncode}：{result.stderr.strip()[:200]}")
+
+
+def probe_telegram(proxy_url, timeout):
+    """Telegram API 能否连接（配置了代理时通过代理的 CONNECT 隧道）"""
+    if not proxy_url:
+        with socket.create_connection((TELEGRAM_API_HOST, TELEGRAM_API_PORT), timeout=timeout):
+            return
+    host, port = _parse_host_port(proxy_url, 80)
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        sock.settimeout(timeout)
+        target = f"{TELEGRAM_API_HOST}:{TELEGRAM_API_PORT}"
+        sock.sendall(f"CONNECT {target} HTTP/1.1\r\nHost: {target}\r\n\r\n".encode())
+        status_line = sock.recv(1024).split(b"\r\n", 1)[0].decode(errors="replace")
+        if " 200" not in status_line:
+            raise RuntimeError(f"代理 CONNECT 失败：{status_line or '无响应'}")
+
+
+def _describe_error(error):
+    if isinstance(error, subprocess.TimeoutExpired):
+        return "响应超时"
+    if isinstance(error, socket.timeout):
+        return "连接超时"
+    if isinstance(error, ConnectionRefusedError):
+        return "连接被拒绝"
+    return str(error) or error.__class__.__name__
+
+
+# ---------- 熔断状态 ----------
+
+def record_success(name, latency_ms=None):
+    """记录一次成功，熔断中的依赖随之恢复"""
+    with _state_lock:
+        state = _state.setdefault(name, _new_state())
+        if state["open"]:
+            logging.info(f"Dependency {name} recovered, closing circuit breaker")
+        state.update({
+            "open": False,
+            "failures": 0,
+            "detail": "",
+            "latency_ms": latency_ms,
+            "checked_at": time.time(),
+            "opened_at": None
+        })
+
+
+def record_failure(name, detail, trip=False):
+    """
+    记录一次失败
+
+    Args:
+        name: proxy / agent / telegram
+        detail: 失败原因
+        trip: 为 True 时立即熔断（如 agent 启动失败），否则连续失败达到阈值才熔断
+    """
+    with _state_lock:
+        state = _state.setdefault(name, _new_state())
+        state["failures"] += 1
+        state["detail"] = detail
+        state["checked_at"] = time.time()
+        if not state["open"] and (trip or state["failures"] >= _settings["failure_threshold"]):
+            state["open"] = True
+            state["opened_at"] = time.time()
+            logging.error(f"Dependency {name} is down ({detail}), opening circuit breaker")
+            # 熔断后立即改用更短的探测间隔
+            _wakeup.set()
+        else:
+            logging.warning(f"Dependency {name} check failed ({state['failures']}): {detail}")
+
+
+def is_open(name):
+    """依赖是否处于熔断状态"""
+    with _state_lock:
+        return _state.get(name, {}).get("open", False)
+
+
+def check_task_dependencies():
+    """
+    检查执行任务所需的依赖
+
+    Returns:
+        str: 熔断中依赖的原因说明（可直接回复给用户）；全部正常时返回 None
+    """
+    with _state_lock:
+        reasons = [
+            f"{_DEPENDENCY_NAMES[name]}不可用（{_state[name]['detail']}）"
+            for name in TASK_DEPENDENCIES
+            if _state.get(name, {}).get("open")
+        ]
+    return "；".join(reasons) if reasons else None
+
+
+# ---------- 后台探测 ----------
+
+def _run_probe(name, probe, *args):
+    started = time.monotonic()
+    try:
+        probe(*args)
+    except Exception as e:
+        record_failure(name, _describe_error(e))
+        return
+    record_success(name, round((time.monotonic() - started) * 1000))
+
+
+def _probe_loop(agent_path, proxy_url, telegram_proxy_url):
+    timeout = _settings["probe_timeout_seconds"]
+    while True:
+        _run_probe("proxy", probe_proxy, proxy_url, timeout)
+        _run_probe("agent", probe_agent, agent_path, timeout)
+        _run_probe("telegram", probe_telegram, telegram_proxy_url, timeout)
+        with _state_lock:
+            any_open = any(state["open"] for state in _state.values())
+        interval = _settings["open_probe_interval_seconds"] if any_open else _settings["probe_interval_seconds"]
+        _wakeup.wait(interval)
+        _wakeup.clear()
+
+
+def start_health_monitor(config, agent_path, proxy_url, telegram_proxy_url=None):
+    """
+    启动后台健康探测
+
+    Args:
+        config: load_config() 返回的配置字典
+        agent_path: agent 可执行文件路径
+        proxy_url: agent 子进程使用的代理（HTTPS_PROXY）
+        telegram_proxy_url: Bot 连接 Telegram 使用的代理，未使用代理时为 None
+    """
+    global _settings
+    settings = dict(DEFAULT_HEALTH_CONFIG)
+    settings.update(config.get("health") or {})
+    _settings = settings
+    _targets.update({
+        "proxy": "{}:{}".format(*_parse_host_port(proxy_url, 80)),
+        "agent": agent_path,
+        "telegram": TELEGRAM_API_HOST
+    })
+    threading.Thread(
+        target=_probe_loop,
+        args=(agent_path, proxy_url, telegram_proxy_url),
+        daemon=True,
+        name="health-monitor"
+    ).start()
+    logging.info(f"Health monitor started (proxy {_targets['proxy']}, agent {agent_path})")
+
+
+def _format_ago(timestamp):
+    seconds = int(time.time() - timestamp)
+    return f"{seconds}秒前" if seconds < 60 else f"{seconds // 60}分钟前"
+
+
+def format_health_status():
+    """格式化各依赖的健康状态，用于 /status"""
+    lines = []
+    with _state_lock:
+        for name in ("proxy", "agent", "telegram"):
+            label = f"{_DEPENDENCY_NAMES[name]}（{_targets.get(name, '-')}）"
+            state = _state.get(name)
+            if state is None or state["checked_at"] is None:
+                lines.append(f"- {label}：⏳ 尚未探测")
+            elif state["open"]:
+                lines.append(f"- {label}：❌ 熔断中，{state['detail']}（{_format_ago(state['opened_at'])}起）")
+            elif state["failures"]:
+                lines.append(f"- {label}：⚠️ 最近一次检查失败，{state['detail']}")
+            else:
+                latency = f"{state['latency_ms']}ms，" if state["latency_ms"] is not None else ""
+                lines.append(f"- {label}：✅ 正常（{latency}{_format_ago(state['checked_at'])}检查）")
+    return "\n".join(lines)
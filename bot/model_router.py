@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+模型自动路由模块
+按（模型, 项目, 任务规模）维护滚动的耗时与成功率统计，
+在 --model auto 时选择满足延迟目标的候选模型，并保留一定的探索比例。
+"""
+
+import re
+import random
+import logging
+from collections import defaultdict, deque
+
+# 默认路由配置（可被 config/bot_config.json 的 model_routing 段覆盖）
+DEFAULT_ROUTING_CONFIG = {
+    "enabled": False,
+    "candidates": [],
+    "latency_target_seconds": {"small": 30, "medium": 120, "large": 600},
+    "exploration_rate": 0.1,
+    "min_samples": 3,
+    "min_success_rate": 0.8,
+    "window": 50,
+    "overrides": {}
+}
+
+SIZE_BUCKETS = ("small", "medium", "large")
+
+# 任务规模关键词：命中 large 关键词提升一级，命中 small 关键词且描述较短时视为 small
+_LARGE_KEYWORDS = r'重构|refactor|实现|implement|迁移|migrat|测试|tests?\b|所有|全部|整个|rewrite|重写'
+_SMALL_KEYWORDS = r'什么|为什么|如何|怎么|解释|查看|列出|explain|what|why|how|list|show|[?？]'
+
+# 项目无关的汇总统计使用的项目键
+_ANY_PROJECT = "*"
+
+_stats = defaultdict(deque)  # (model, project, bucket) -> deque[(duration_seconds, success)]
+
+
+def get_routing_settings(config):
+    """合并默认值与配置中的 model_routing 段"""
+    settings = dict(DEFAULT_ROUTING_CONFIG)
+    settings.update(config.get("model_routing") or {})
+    return settings
+
+
+def size_bucket(description):
+    """
+    根据描述长度与关键词估计任务规模
+
+    Returns:
+        str: small / medium / large
+    """
+    length = len(description)
+    level = 0 if length < 80 else 1 if length < 300 else 2
+    if re.search(_LARGE_KEYWORDS, description, re.IGNORECASE):
+        level = min(level + 1, 2)
+    elif level < 2 and re.search(_SMALL_KEYWORDS, description, re.IGNORECASE):
+        level = 0
+    return SIZE_BUCKETS[level]
+
+
+def record_result(model, project_path, bucket, duration_seconds, success, window=None):
+    """
+    记录一次任务结果
+
+    Args:
+        model: 实际使用的模型
+        project_path: 项目路径
+        bucket: size_bucket() 的结果
+        duration_seconds: 任务耗时（秒）
+        success: 是否成功
+        window: 每个统计键保留的样本数
+    """
+    window = window or DEFAULT_ROUTING_CONFIG["window"]
+    for key in ((model, project_path, bucket), (model, _ANY_PROJECT, bucket)):
+        samples = _stats[key]
+        samples.append((duration_seconds, bool(success)))
+        while len(samples) > window:
+            samples.popleft()
+
+
+def warm_up(records, config):
+    """
+    用任务历史预热统计
+
+    Args:
+        records: task_history.load_task_history() 返回的记录
+        config: load_config() 返回的配置字典
+    """
+    window = get_routing_settings(config)["window"]
+    count = 0
+    for record in records:
+        duration = _record_duration(record)
+        if not record.get("model") or duration is None:
+            continue
+        bucket = record.get("size_bucket") or size_bucket(record.get("description", ""))
+        record_result(record["model"], record.get("project_path", ""), bucket, duration, record.get("success"), window)
+        count += 1
+    logging.info(f"Model router warmed up with {count} historical tasks")
+
+
+def _record_duration(record):
+    if record.get("duration_ms"):
+        return record["duration_ms"] / 1000
+    return record.get("wall_seconds")
+
+
+def _summarize(samples):
+    durations = sorted(d for d, _ in samples)
+    return {
+        "count": len(samples),
+        "p50": durations[len(durations) // 2],
+        "success_rate": sum(1 for _, ok in samples if ok) / len(samples)
+    }
+
+
+def _candidate_summary(model, project_path, bucket, min_samples):
+    for project_key in (project_path, _ANY_PROJECT):
+        samples = _stats.get((model, project_key, bucket))
+        if samples and len(samples) >= min_samples:
+            return _summarize(samples)
+    return None
+
+
+def choose_model(requested, project_path, description, config, user_id=None):
+    """
+    选择本次任务使用的模型
+
+    Args:
+        requested: 用户指定的模型（--model，默认 auto）
+        project_path: 项目路径
+        description: 任务描述
+        config: load_config() 返回的配置字典
+        user_id: 用户ID（用于按用户覆盖）
+
+    Returns:
+        tuple: (model, reason)，reason 为 manual / default / override / explore / target / fastest
+    """
+    if requested != "auto":
+        return requested, "manual"
+    settings = get_routing_settings(config)
+    candidates = settings["candidates"]
+    if not settings["enabled"] or not candidates:
+        return requested, "default"
+
+    overrides = settings["overrides"] or {}
+    override = overrides.get(project_path) or overrides.get(str(user_id))
+    if override:
+        return override, "override"
+
+    if random.random() < settings["exploration_rate"]:
+        return random.choice(candidates), "explore"
+
+    bucket = size_bucket(description)
+    target = settings["latency_target_seconds"].get(bucket, DEFAULT_ROUTING_CONFIG["latency_target_seconds"][bucket])
+    summaries = {}
+    for model in candidates:
+        summary = _candidate_summary(model, project_path, bucket, settings["min_samples"])
+        if summary is None:
+            # 数据不足的候选优先探索，以便尽快积累统计
+            return model, "explore"
+        summaries[model] = summary
+
+    reliable = {m: s for m, s in summaries.items() if s["success_rate"] >= settings["min_success_rate"]}
+    # 候选列表的顺序即偏好顺序：选第一个满足延迟目标的可靠模型
+    for model in candidates:
+        if model in reliable and reliable[model]["p50"] <= target:
+            return model, "target"
+    if reliable:
+        return min(reliable, key=lambda m: reliable[m]["p50"]), "fastest"
+    return max(summaries, key=lambda m: summaries[m]["success_rate"]), "fastest"
+
+
+def format_routing_stats(project_path=None):
+    """格式化各模型的统计（项目无关汇总），用于诊断"""
+    lines = []
+    for (model, project_key, bucket), samples in sorted(_stats.items()):
+        if project_key != (project_path or _ANY_PROJECT) or not samples:
+            continue
+        summary = _summarize(samples)
+        lines.append(
+            f"- {model} [{bucket}]: {summary['count']} 次，p50 {summary['p50']:.0f}秒，"
+            f"成功率 {summary['success_rate'] * 100:.0f}%"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+性能诊断模块
+- 事件循环卡顿监控：超过阈值时记录阻塞协程的调用栈
+- 采样分析器：对整个 bot 进程按固定间隔采样调用栈，输出折叠栈与热点函数
+- 处理耗时分段：记录每条消息在认证、限流、解析、会话查询、启动进程、发送回复等阶段的耗时
+"""
+
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+import contextvars
+from contextlib import contextmanager
+from collections import Counter, defaultdict
+
+# 默认诊断配置（可被 config/bot_config.json 的 profiling 段覆盖）
+DEFAULT_PROFILING_CONFIG = {
+    "loop_lag_threshold_ms": 200,
+    "loop_monitor_interval_ms": 100,
+    "sample_interval_ms": 10,
+    "max_profile_seconds": 300
+}
+
+# ---------- 事件循环卡顿监控 ----------
+
+_loop_state = {
+    "heartbeat": None,
+    "thread_id": None,
+    "watchdog_id": None,
+    "max_lag_ms": 0.0,
+    "stalls": 0
+}
+
+
+async def _heartbeat(interval):
+    while True:
+        before = time.monotonic()
+        _loop_state["heartbeat"] = before
+        await asyncio.sleep(interval)
+        lag_ms = (time.monotonic() - before - interval) * 1000
+        _loop_state["max_lag_ms"] = max(_loop_state["max_lag_ms"], lag_ms)
+
+
+def _watchdog(interval, threshold):
+    reported = None
+    while True:
+        time.sleep(interval / 2)
+        heartbeat = _loop_state["heartbeat"]
+        if heartbeat is None:
+            continue
+        blocked = time.monotonic() - heartbeat - interval
+        if blocked < threshold or reported == heartbeat:
+            continue
+        # 同一次卡顿只记录一次，调用栈即阻塞事件循环的代码位置
+        reported = heartbeat
+        _loop_state["stalls"] += 1
+        frame = sys._current_frames().get(_loop_state["thread_id"])
+        stack = "".join(traceback.format_stack(frame)) if frame else "(stack unavailable)"
+        logging.warning(f"Event loop blocked for {blocked * 1000:.0f}ms, blocking stack:\n{stack}")
+
+
+def start_loop_monitor(config):
+    """
+    在当前事件循环中启动卡顿监控（需在事件循环内调用）
+
+    Args:
+        config: load_config() 返回的配置字典
+    """
+    settings = get_profiling_settings(config)
+    interval = settings["loop_monitor_interval_ms"] / 1000
+    threshold = settings["loop_lag_threshold_ms"] / 1000
+    _loop_state["thread_id"] = threading.get_ident()
+    asyncio.get_running_loop().create_task(_heartbeat(interval))
+    watchdog = threading.Thread(target=_watchdog, args=(interval, threshold), daemon=True, name="loop-watchdog")
+    watchdog.start()
+    _loop_state["watchdog_id"] = watchdog.ident
+    logging.info(f"Event loop monitor started (threshold={settings['loop_lag_threshold_ms']}ms)")
+
+
+def get_profiling_settings(config):
+    """合并默认值与配置中的 profiling 段"""
+    settings = dict(DEFAULT_PROFILING_CONFIG)
+    settings.update(config.get("profiling") or {})
+    return settings
+
+
+# ---------- 采样分析器 ----------
+
+_profile_state = {
+    "thread": None,
+    "stop_event": None,
+    "samples": Counter(),
+    "started_at": None,
+    "sample_count": 0
+}
+
+
+def _sample_loop(interval, stop_event, samples):
+    # 不采样分析器自身与卡顿监控线程
+    skipped_ids = {threading.get_ident(), _loop_state["watchdog_id"]}
+    thread_names = {}
+    while not stop_event.wait(interval):
+        thread_names.update({t.ident: t.name for t in threading.enumerate()})
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id in skipped_ids:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                frame = frame.f_back
+            stack.append(thread_names.get(thread_id, str(thread_id)))
+            samples[";".join(reversed(stack))] += 1
+        _profile_state["sample_count"] += 1
+
+
+def is_profiling():
+    """采样分析器是否正在运行"""
+    return _profile_state["thread"] is not None
+
+
+def start_profiling(config):
+    """
+    启动采样分析器
+
+    Returns:
+        bool: 成功启动返回 True，已在运行时返回 False
+    """
+    if is_profiling():
+        return False
+    interval = get_profiling_settings(config)["sample_interval_ms"] / 1000
+    stop_event = threading.Event()
+    samples = Counter()
+    thread = threading.Thread(target=_sample_loop, args=(interval, stop_event, samples), daemon=True, name="sampler")
+    _profile_state.update({
+        "thread": thread,
+        "stop_event": stop_event,
+        "samples": samples,
+        "started_at": time.monotonic(),
+        "sample_count": 0
+    })
+    thread.start()
+    logging.info("Sampling profiler started")
+    return True
+
+
+def stop_profiling():
+    """
+    停止采样分析器并生成报告
+
+    Returns:
+        str: 报告文本（热点函数 + 折叠栈）；未在运行时返回 None
+    """
+    if not is_profiling():
+        return None
+    _profile_state["stop_event"].set()
+    _profile_state["thread"].join(timeout=5)
+    duration = time.monotonic() - _profile_state["started_at"]
+    samples = _profile_state["samples"]
+    sample_count = _profile_state["sample_count"]
+    _profile_state["thread"] = None
+    logging.info(f"Sampling profiler stopped after {duration:.1f}s, {sample_count} samples")
+    return _format_profile(samples, duration, sample_count)
+
+
+def _format_profile(samples, duration, sample_count):
+    self_counts = Counter()
+    total_counts = Counter()
+    for stack, count in samples.items():
+        frames = stack.split(";")[1:]
+        if not frames:
+            continue
+        self_counts[frames[-1]] += count
+        for frame in set(frames):
+            total_counts[frame] += count
+    total = sum(samples.values()) or 1
+
+    lines = [
+        f"# sampling profile: {duration:.1f}s, {sample_count} ticks, {total} thread samples",
+        "",
+        "# top functions (self% / total%)"
+    ]
+    for frame, count in self_counts.most_common(30):
+        lines.append(f"{count * 100 / total:6.2f}% {total_counts[frame] * 100 / total:6.2f}%  {frame}")
+    lines.append("")
+    lines.append("# handler spans (count / avg ms / max ms)")
+    lines.append(format_span_stats())
+    lines.append("")
+    lines.append("# collapsed stacks (flamegraph.pl / speedscope)")
+    for stack, count in samples.most_common():
+        lines.append(f"{stack} {count}")
+    return "\n".join(lines)
+
+
+# ---------- 处理耗时分段 ----------
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_span_stats = defaultdict(lambda: {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+
+
+def start_trace(label):
+    """
+    为当前协程开始一次耗时追踪
+
+    Returns:
+        dict: 追踪对象，需传给 finish_trace()
+    """
+    trace = {"label": label, "started_at": time.perf_counter(), "spans": []}
+    _current_trace.set(trace)
+    return trace
+
+
+@contextmanager
+def span(name):
+    """记录一个阶段的耗时（计入当前追踪与全局统计）"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        stats = _span_stats[name]
+        stats["count"] += 1
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace["spans"].append((name, elapsed_ms))
+
+
+def finish_trace(trace):
+    """结束追踪并记录各阶段耗时"""
+    total_ms = (time.perf_counter() - trace["started_at"]) * 1000
+    spans = ", ".join(f"{name}={elapsed:.1f}ms" for name, elapsed in trace["spans"])
+    logging.info(f"Trace {trace['label']}: total={total_ms:.1f}ms, {spans}")
+
+
+def format_span_stats():
+    """格式化各阶段耗时的累计统计"""
+    if not _span_stats:
+        return "(no spans recorded)"
+    lines = []
+    for name, stats in sorted(_span_stats.items()):
+        avg = stats["total_ms"] / stats["count"]
+        lines.append(f"{name}: {stats['count']} / {avg:.2f} / {stats['max_ms']:.2f}")
+    return "\n".join(lines)
+
+
+def get_loop_stats():
+    """返回事件循环卡顿统计"""
+    return {"max_lag_ms": _loop_state["max_lag_ms"], "stalls": _loop_state["stalls"]}
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+项目状态索引模块
+为 PROJECT_TRIGGER_MAPPING 中的每个项目缓存路径是否存在、git 分支、HEAD、
+与上游的 ahead/behind 以及未提交文件数。启动时在线程池中计算，之后通过
+inotify 监听 .git/HEAD、index、packed-refs 与 refs/heads 及其子目录（不支持 inotify 的平台使用 mtime 轮询）
+并定期全量校准，使 /status 与切换项目的回复无需等待 git 命令。
+"""
+
+import os
+import sys
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+# 默认索引配置（可被 config/bot_config.json 的 project_index 段覆盖）
+DEFAULT_INDEX_CONFIG = {
+    "reconcile_seconds": 300,
+    "poll_seconds": 5,
+    "workers": 4,
+    "git_timeout_seconds": 10
+}
+
+# inotify 事件掩码
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_ISDIR = 0x40000000
+_IN_EVENT_HEADER = struct.Struct("iIII")
+
+# 触发刷新的 .git 内文件（git 通过 *.lock 改名写入）
+_WATCHED_NAMES = {"HEAD", "index", "ORIG_HEAD", "FETCH_HEAD", "packed-refs"}
+
+_WATCH_MASK = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE | _IN_MODIFY
+
+# 事件静默多少秒后再刷新，合并一次 git 操作产生的多个事件
+_DEBOUNCE_SECONDS = 0.5
+
+_settings = dict(DEFAULT_INDEX_CONFIG)
+_projects = {}  # project_name -> project_path
+_index = {}  # project_name -> status dict
+_index_lock = threading.Lock()
+_executor = None
+
+
+def _run_git(project_path, args):
+    result = subprocess.run(
+        ["git", "--no-optional-locks"] + args,
+        cwd=project_path,
+        capture_output=True,
+        text=True,
+        timeout=_settings["git_timeout_seconds"]
+    )
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip()
+
+
+def compute_project_status(project_path):
+    """
+    计算单个项目的状态（会执行若干 git 命令，需在后台线程中调用）
+
+    Args:
+        project_path: 项目路径
+
+    Returns:
+        dict: exists / is_git / branch / head / subject / committed / ahead / behind / dirty / updated_at
+    """
+    status = {
+        "exists": os.path.isdir(project_path),
+        "is_git": False,
+        "branch": None,
+        "head": None,
+        "subject": None,
+        "committed": None,
+        "ahead": None,
+        "behind": None,
+        "dirty": None,
+        "updated_at": datetime.now().isoformat(timespec="seconds")
+    }
+    if not status["exists"]:
+        return status
+    try:
+        if _run_git(project_path, ["rev-parse", "--git-dir"]) is None:
+            return status
+        status["is_git"] = True
+        status["branch"] = _run_git(project_path, ["rev-parse", "--abbrev-ref", "HEAD"])
+        head = _run_git(project_path, ["log", "-1", "--format=%h%x09%s%x09%cr"])
+        if head:
+            status["head"], status["subject"], status["committed"] = (head.split("\t") + [None, None])[:3]
+        counts = _run_git(project_path, ["rev-list", "--left-right", "--count", "@{upstream}...HEAD"])
+        if counts:
+            behind, ahead = counts.split()
+            status["behind"], status["ahead"] = int(behind), int(ahead)
+        porcelain = _run_git(project_path, ["status", "--porcelain"])
+        if porcelain is not None:
+            status["dirty"] = len([line for line in porcelain.splitlines() if line.strip()])
+    except (subprocess.TimeoutExpired, OSError, ValueError) as e:
+        logging.warning(f"Failed to compute git status for {project_path}: {e}")
+    return status
+
+
+def refresh_project(project_name):
+    """重新计算某个项目的状态并写入索引"""
+    project_path = _projects.get(project_name)
+    if project_path is None:
+        return
+    status = compute_project_status(project_path)
+    with _index_lock:
+        _index[project_name] = status
+    logging.debug(f"Refreshed project index for {project_name}")
+
+
+def _refresh_all():
+    for project_name in list(_projects):
+        _executor.submit(refresh_project, project_name)
+
+
+def _reconcile_loop():
+    """定期全量校准（覆盖 fetch 等不会触发 HEAD/index 变化的操作）"""
+    while True:
+        time.sleep(_settings["reconcile_seconds"])
+        _refresh_all()
+
+
+# ---------- 变更监听 ----------
+
+def _git_dir(project_path):
+    return os.path.join(project_path, ".git")
+
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+def _add_watch(libc, fd, watches, path, project_name, is_refs):
+    wd = libc.inotify_add_watch(fd, path.encode(), _WATCH_MASK)
+    if wd >= 0:
+        watches[wd] = (project_name, is_refs, path)
+
+
+def _add_refs_watches(libc, fd, watches, refs_dir, project_name):
+    """监听 refs/heads 及其所有子目录（分支名含斜杠时，如 feature/x）"""
+    for dirpath, _, _ in os.walk(refs_dir):
+        _add_watch(libc, fd, watches, dirpath, project_name, True)
+
+
+def _inotify_loop(libc, fd, watches):
+    pending = {}
+    while True:
+        readable, _, _ = select.select([fd], [], [], _DEBOUNCE_SECONDS)
+        if readable:
+            data = os.read(fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, name_len = _IN_EVENT_HEADER.unpack_from(data, offset)
+                offset += _IN_EVENT_HEADER.size
+                name = data[offset:offset + name_len].rstrip(b"\0").decode(errors="ignore")
+                offset += name_len
+                project_name, is_refs, path = watches.get(wd, (None, False, None))
+                if project_name and is_refs and mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                    # 新建了分支目录（如首次创建 feature/ 下的分支）
+                    _add_refs_watches(libc, fd, watches, os.path.join(path, name), project_name)
+                if project_name and (is_refs or name in _WATCHED_NAMES):
+                    pending[project_name] = time.monotonic()
+        now = time.monotonic()
+        for project_name, last_event in list(pending.items()):
+            if now - last_event >= _DEBOUNCE_SECONDS:
+                del pending[project_name]
+                _executor.submit(refresh_project, project_name)
+
+
+def _start_inotify_watcher():
+    """使用 inotify 监听各项目的 .git 目录，返回是否成功"""
+    libc = _load_libc()
+    if libc is None:
+        return False
+    fd = libc.inotify_init1(os.O_CLOEXEC)
+    if fd < 0:
+        logging.warning(f"inotify_init1 failed: errno {ctypes.get_errno()}")
+        return False
+    watches = {}
+    for project_name, project_path in _projects.items():
+        git_dir = _git_dir(project_path)
+        if not os.path.isdir(git_dir):
+            continue
+        _add_watch(libc, fd, watches, git_dir, project_name, False)
+        _add_refs_watches(libc, fd, watches, os.path.join(git_dir, "refs", "heads"), project_name)
+    threading.Thread(target=_inotify_loop, args=(libc, fd, watches), daemon=True, name="project-inotify").start()
+    logging.info(f"Project index watching {len(watches)} git directories via inotify")
+    return True
+
+
+def _mtime_signature(project_path):
+    git_dir = _git_dir(project_path)
+    signature = []
+    # logs/HEAD 在当前分支每次提交时追加（含 feature/x 这类嵌套分支），packed-refs 在 gc / pack-refs 后变化
+    for name in ("HEAD", "index", "packed-refs", os.path.join("logs", "HEAD"), os.path.join("refs", "heads")):
+        try:
+            signature.append(os.stat(os.path.join(git_dir, name)).st_mtime_ns)
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def _poll_loop():
+    """不支持 inotify 时（如 macOS）按 mtime 轮询 .git 中的关键文件"""
+    signatures = {name: _mtime_signature(path) for name, path in _projects.items()}
+    while True:
+        time.sleep(_settings["poll_seconds"])
+        for project_name, project_path in _projects.items():
+            signature = _mtime_signature(project_path)
+            if signature != signatures.get(project_name):
+                signatures[project_name] = signature
+                _executor.submit(refresh_project, project_name)
+
+
+def start_project_index(project_mapping, config):
+    """
+    启动项目状态索引：后台计算初始状态，并开始监听变更与定期校准
+
+    Args:
+        project_mapping: PROJECT_TRIGGER_MAPPING
+        config: load_config() 返回的配置字典
+    """
+    global _executor, _settings
+    settings = dict(DEFAULT_INDEX_CONFIG)
+    settings.update(config.get("project_index") or {})
+    _settings = settings
+    _projects.clear()
+    _projects.update({name: info.get("path", "") for name, info in project_mapping.items()})
+    if not _projects:
+        return
+    _executor = ThreadPoolExecutor(max_workers=settings["workers"], thread_name_prefix="project-index")
+    _refresh_all()
+    if not _start_inotify_watcher():
+        threading.Thread(target=_poll_loop, daemon=True, name="project-poll").start()
+    threading.Thread(target=_reconcile_loop, daemon=True, name="project-reconcile").start()
+    logging.info(f"Project index started for {len(_projects)} projects")
+
+
+# ---------- 查询 ----------
+
+def get_project_status(project_name):
+    """返回缓存的项目状态；尚未计算完成时返回 None"""
+    with _index_lock:
+        return _index.get(project_name)
+
+
+def find_project_name(project_path):
+    """根据路径查找项目名称"""
+    normalized = os.path.normpath(project_path)
+    for project_name, path in _projects.items():
+        if os.path.normpath(path) == normalized:
+            return project_name
+    return None
+
+
+def format_project_status(project_name):
+    """
+    格式化项目状态为一行文本
+
+    Returns:
+        str: 例如 "🌿 main @ a1b2c3d · ↑1 ↓0 · 3 个未提交文件 · fix bug（2 hours ago）"
+    """
+    status = get_project_status(project_name)
+    if status is None:
+        return "⏳ 状态加载中"
+    if not status["exists"]:
+        return "⚠️ 路径不存在"
+    if not status["is_git"]:
+        return "📁 非 git 仓库"
+    parts = [f"🌿 {status['branch'] or '?'} @ {status['head'] or '?'}"]
+    if status["ahead"] is not None:
+        parts.append(f"↑{status['ahead']} ↓{status['behind']}")
+    if status["dirty"] is not None:
+        parts.append(f"{status['dirty']} 个未提交文件" if status["dirty"] else "工作区干净")
+    if status["subject"]:
+        parts.append(f"{status['subject'][:50]}（{status['committed']}）")
+    return " · ".join(parts)
+
+
+def format_all_project_status():
+    """格式化所有项目的状态，用于 /status"""
+    lines = []
+    for project_name, project_path in _projects.items():
+        lines.append(f"- {project_name}（{project_path}）\n  {format_project_status(project_name)}")
+    return "\n".join(lines)
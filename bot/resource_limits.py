@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+任务资源统计与限制模块
+统计每个 agent 任务的 CPU 时间、峰值内存与 I/O 字节数（os.wait4 / cgroup v2），
+并在启动子进程时施加 RLIMIT 或 cgroup v2 内存/CPU 配额。
+"""
+
+import os
+import re
+import sys
+import signal
+import logging
+
+try:
+    import resource
+except ImportError:  # Windows 不支持 resource 模块
+    resource = None
+
+# 默认资源限制配置（可被 config/bot_config.json 的 resource_limits 段覆盖）
+DEFAULT_RESOURCE_LIMITS = {
+    "memory_mb": None,
+    "cpu_seconds": None,
+    "cpu_quota_percent": None,
+    "use_cgroup": False,
+    "cgroup_root": "/sys/fs/cgroup/cursor-telegram-bot"
+}
+
+# 任务子组需要的控制器（memory.max / cpu.max / memory.events / io.stat）
+_CGROUP_CONTROLLERS = ("memory", "cpu", "io")
+
+# ru_inblock / ru_oublock 以 512 字节块计数
+_BLOCK_SIZE = 512
+
+# RLIMIT_DATA 触发时进程通常因分配失败而退出，通过 stderr 中的特征识别
+_OOM_PATTERNS = [
+    r'MemoryError',
+    r'out of memory',
+    r'Cannot allocate memory',
+    r'ENOMEM',
+    r'std::bad_alloc'
+]
+
+
+def get_resource_limits(config):
+    """
+    合并默认值与配置中的 resource_limits
+
+    Args:
+        config: load_config() 返回的配置字典
+
+    Returns:
+        dict: 资源限制配置
+    """
+    limits = dict(DEFAULT_RESOURCE_LIMITS)
+    limits.update(config.get("resource_limits") or {})
+    return limits
+
+
+def create_task_cgroup(task_id, limits):
+    """
+    为任务创建 cgroup v2 子组并写入 memory.max / cpu.max
+
+    Args:
+        task_id: 任务唯一标识（用作子组目录名）
+        limits: get_resource_limits() 返回的配置
+
+    Returns:
+        str: cgroup 目录路径；未启用或创建失败时返回 None（此时回退到 RLIMIT）
+    """
+    if not limits.get("use_cgroup") or not sys.platform.startswith("linux"):
+        return None
+    cgroup_path = os.path.join(limits["cgroup_root"], f"task-{task_id}")
+    try:
+        os.makedirs(limits["cgroup_root"], exist_ok=True)
+        _enable_controllers(limits["cgroup_root"])
+        os.makedirs(cgroup_path, exist_ok=True)
+        if limits.get("memory_mb"):
+            _write_cgroup_file(cgroup_path, "memory.max", str(int(limits["memory_mb"]) * 1024 * 1024))
+            _write_cgroup_file(cgroup_path, "memory.swap.max", "0")
+        if limits.get("cpu_quota_percent"):
+            period = 100000
+            quota = int(period * float(limits["cpu_quota_percent"]) / 100)
+            _write_cgroup_file(cgroup_path, "cpu.max", f"{quota} {period}")
+        return cgroup_path
+    except OSError as e:
+        logging.warning(f"Failed to create cgroup {cgroup_path}, falling back to rlimits: {e}")
+        remove_task_cgroup(cgroup_path)
+        return None
+
+
+def _enable_controllers(cgroup_root):
+    """
+    在 cgroup_root 的 cgroup.subtree_control 中启用子组需要的控制器
+
+    新建的 cgroup 默认不向子组下放任何控制器，子组中便没有 memory.max 等文件。
+    cgroup_root 本身可用的控制器由上级的 subtree_control 决定，缺少 memory 时抛出 OSError。
+    """
+    with open(os.path.join(cgroup_root, "cgroup.controllers"), 'r') as f:
+        available = f.read().split()
+    if "memory" not in available:
+        raise OSError(f"memory controller is not delegated to {cgroup_root}")
+    with open(os.path.join(cgroup_root, "cgroup.subtree_control"), 'r') as f:
+        enabled = f.read().split()
+    missing = [name for name in _CGROUP_CONTROLLERS if name in available and name not in enabled]
+    if missing:
+        _write_cgroup_file(cgroup_root, "cgroup.subtree_control", " ".join(f"+{name}" for name in missing))
+
+
+def _write_cgroup_file(cgroup_path, name, value):
+    with open(os.path.join(cgroup_path, name), 'w') as f:
+        f.write(value)
+
+
+def remove_task_cgroup(cgroup_path):
+    """删除任务的 cgroup 子组（组内进程全部退出后才能成功）"""
+    if not cgroup_path:
+        return
+    try:
+        os.rmdir(cgroup_path)
+    except OSError as e:
+        logging.warning(f"Failed to remove cgroup {cgroup_path}: {e}")
+
+
+def apply_limits(limits, cgroup_path=None):
+    """
+    让当前进程加入 cgroup，并设置 RLIMIT_DATA / RLIMIT_CPU（限制会被之后启动的子进程继承）
+
+    由 task_supervisor.py 在启动 agent 前对自身调用；不在 Bot 进程中使用 preexec_fn，
+    因为 Bot 运行着多个线程，fork 后、exec 前执行 Python 代码可能死锁。
+    内存限制使用 RLIMIT_DATA 而不是 RLIMIT_AS，因为 Node.js 等运行时会预留大量虚拟地址空间。
+
+    Args:
+        limits: get_resource_limits() 返回的配置（只使用 memory_mb / cpu_seconds）
+        cgroup_path: create_task_cgroup() 返回的目录（可为 None）
+    """
+    if cgroup_path:
+        with open(os.path.join(cgroup_path, "cgroup.procs"), 'w') as f:
+            f.write(str(os.getpid()))
+    if resource is None:
+        return
+    memory_mb = limits.get("memory_mb")
+    cpu_seconds = limits.get("cpu_seconds")
+    if memory_mb and not cgroup_path:
+        memory_bytes = int(memory_mb) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_DATA, (memory_bytes, memory_bytes))
+    if cpu_seconds:
+        # 软限制触发 SIGXCPU，硬限制留 5 秒余量后 SIGKILL
+        resource.setrlimit(resource.RLIMIT_CPU, (int(cpu_seconds), int(cpu_seconds) + 5))
+
+
+def usage_from_rusage(rusage):
+    """
+    将 rusage 转换为统一的资源使用字典
+
+    Returns:
+        dict: cpu_seconds / peak_rss_bytes / io_read_bytes / io_write_bytes；rusage 为空时返回 None
+    """
+    if rusage is None:
+        return None
+    # Linux 的 ru_maxrss 单位为 KB，macOS 为字节
+    rss_unit = 1 if sys.platform == "darwin" else 1024
+    return {
+        "cpu_seconds": round(rusage.ru_utime + rusage.ru_stime, 3),
+        "peak_rss_bytes": rusage.ru_maxrss * rss_unit,
+        "io_read_bytes": rusage.ru_inblock * _BLOCK_SIZE,
+        "io_write_bytes": rusage.ru_oublock * _BLOCK_SIZE
+    }
+
+
+def read_cgroup_usage(cgroup_path):
+    """
+    读取 cgroup v2 的累计资源使用（覆盖整个进程树）
+
+    Returns:
+        dict: 与 usage_from_rusage() 相同的结构，另含 oom_kills；读取失败时返回 None
+    """
+    if not cgroup_path:
+        return None
+    try:
+        cpu_stat = _read_key_values(os.path.join(cgroup_path, "cpu.stat"))
+        memory_events = _read_key_values(os.path.join(cgroup_path, "memory.events"))
+        usage = {
+            "cpu_seconds": round(cpu_stat.get("usage_usec", 0) / 1e6, 3),
+            "peak_rss_bytes": 0,
+            "io_read_bytes": 0,
+            "io_write_bytes": 0,
+            "oom_kills": memory_events.get("oom_kill", 0)
+        }
+        peak_file = os.path.join(cgroup_path, "memory.peak")
+        if os.path.exists(peak_file):
+            with open(peak_file, 'r') as f:
+                usage["peak_rss_bytes"] = int(f.read().strip() or 0)
+        io_file = os.path.join(cgroup_path, "io.stat")
+        if os.path.exists(io_file):
+            with open(io_file, 'r') as f:
+                for line in f:
+                    for field in line.split()[1:]:
+                        key, _, value = field.partition("=")
+                        if key == "rbytes":
+                            usage["io_read_bytes"] += int(value)
+                        elif key == "wbytes":
+                            usage["io_write_bytes"] += int(value)
+        return usage
+    except (OSError, ValueError) as e:
+        logging.warning(f"Failed to read cgroup usage from {cgroup_path}: {e}")
+        return None
+
+
+def _read_key_values(path):
+    values = {}
+    with open(path, 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 2:
+                values[parts[0]] = int(parts[1])
+    return values
+
+
+def detect_limit_kill(returncode, limits, usage, stderr_text=""):
+    """
+    判断任务是否因资源限制被终止
+
+    Args:
+        returncode: 子进程退出码（负数表示被信号终止）
+        limits: get_resource_limits() 返回的配置
+        usage: 资源使用字典（可为 None）
+        stderr_text: 子进程的 stderr 输出，用于识别内存分配失败
+
+    Returns:
+        str: "memory limit" / "CPU time limit"；未触发限制时返回 None
+    """
+    if returncode == 0:
+        return None
+    usage = usage or {}
+    if usage.get("oom_kills"):
+        return "memory limit"
+    cpu_seconds = limits.get("cpu_seconds")
+    if cpu_seconds:
+        if hasattr(signal, "SIGXCPU") and returncode == -signal.SIGXCPU:
+            return "CPU time limit"
+        if returncode == -signal.SIGKILL and usage.get("cpu_seconds", 0) >= float(cpu_seconds):
+            return "CPU time limit"
+    memory_mb = limits.get("memory_mb")
+    if memory_mb:
+        if usage.get("peak_rss_bytes", 0) >= int(memory_mb) * 1024 * 1024 * 0.9:
+            return "memory limit"
+        if any(re.search(pattern, stderr_text or "", re.IGNORECASE) for pattern in _OOM_PATTERNS):
+            return "memory limit"
+    return None
+
+
+def _format_bytes(num_bytes):
+    for unit in ("B", "KB", "MB"):
+        if num_bytes < 1024:
+            return f"{num_bytes:.0f}{unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f}GB"
+
+
+def format_usage(usage):
+    """
+    格式化资源使用，用于任务结果回复
+
+    Returns:
+        str: 例如 "🖥️ CPU 12.3秒 · 峰值内存 245MB · I/O 读 1MB / 写 3MB"；usage 为空时返回空字符串
+    """
+    if not usage:
+        return ""
+    return (
+        f"🖥️ CPU {usage['cpu_seconds']:.1f}秒 · 峰值内存 {_format_bytes(usage['peak_rss_bytes'])} · "
+        f"I/O 读 {_format_bytes(usage['io_read_bytes'])} / 写 {_format_bytes(usage['io_write_bytes'])}"
+    )
@@ -2,6 +2,7 @@
 """
 会话状态管理模块
 管理用户的项目选择记忆，支持自动过期（第二天0点后失效）
+以及每个（用户, 项目）对应的 agent 对话ID，随项目选择一同过期
 """
 
 import os
@@ -113,11 +114,17 @@ def set_user_project(user_id, project_path, trigger_word):
     """
     user_id_str = str(user_id)
     sessions = load_sessions()
+    today = date.today().strftime("%Y-%m-%d")
+    
+    # 当天内切换项目时保留各项目的 agent 对话，切回时可继续之前的上下文
+    previous = sessions.get(user_id_str) or {}
+    agent_chats = previous.get("agent_chats", {}) if previous.get("date") == today else {}
     
     sessions[user_id_str] = {
         "project_path": project_path,
         "trigger_word": trigger_word,
-        "date": date.today().strftime("%Y-%m-%d")
+        "date": today,
+        "agent_chats": agent_chats
     }
     
     save_sessions(sessions)
@@ -140,6 +147,70 @@ def clear_user_project(user_id):
         logging.info(f"Cleared project selection for user {user_id_str}")
 
 
+def get_agent_chat(user_id, project_path):
+    """
+    获取用户在某个项目上的 agent 对话ID
+    
+    Args:
+        user_id: 用户ID（字符串或整数）
+        project_path: 项目路径
+        
+    Returns:
+        str: 对话ID，如果不存在或会话已过期返回 None
+    """
+    session = get_user_project(user_id)
+    if not session:
+        return None
+    return session.get("agent_chats", {}).get(project_path)
+
+
+def set_agent_chat(user_id, project_path, chat_id):
+    """
+    记录用户在某个项目上的 agent 对话ID（需已有未过期的项目选择）
+    
+    Args:
+        user_id: 用户ID（字符串或整数）
+        project_path: 项目路径
+        chat_id: agent create-chat 返回的对话ID
+        
+    Returns:
+        bool: 是否已记录
+    """
+    user_id_str = str(user_id)
+    sessions = load_sessions()
+    session = sessions.get(user_id_str)
+    if not session or is_expired(session.get("date", "")):
+        return False
+    
+    session.setdefault("agent_chats", {})[project_path] = chat_id
+    save_sessions(sessions)
+    logging.info(f"User {user_id_str} started agent chat {chat_id} for project: {project_path}")
+    return True
+
+
+def clear_agent_chat(user_id, project_path):
+    """
+    清除用户在某个项目上的 agent 对话，下次任务将开始新对话
+    
+    Args:
+        user_id: 用户ID（字符串或整数）
+        project_path: 项目路径
+        
+    Returns:
+        bool: 是否存在并已清除
+    """
+    user_id_str = str(user_id)
+    sessions = load_sessions()
+    agent_chats = (sessions.get(user_id_str) or {}).get("agent_chats", {})
+    
+    if project_path not in agent_chats:
+        return False
+    del agent_chats[project_path]
+    save_sessions(sessions)
+    logging.info(f"Cleared agent chat for user {user_id_str}, project: {project_path}")
+    return True
+
+
 def cleanup_expired_sessions():
     """清理所有过期的会话"""
     sessions = load_sessions()
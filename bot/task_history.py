@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+任务历史记录模块
+以 JSON Lines 格式记录每次 agent 任务的结果、耗时与资源使用
+"""
+
+import os
+import json
+import logging
+from threading import Lock
+
+# 数据文件路径
+DATA_DIR = os.path.join(os.path.dirname(__file__), "../data")
+HISTORY_FILE = os.path.join(DATA_DIR, "task_history.jsonl")
+
+# 文件超过 MAX_HISTORY_BYTES 时裁剪为最近的 MAX_HISTORY_RECORDS 条记录
+MAX_HISTORY_RECORDS = 5000
+MAX_HISTORY_BYTES = 5 * 1024 * 1024
+
+# 文件锁，用于多线程安全
+_file_lock = Lock()
+
+
+def ensure_data_dir():
+    """确保数据目录存在"""
+    if not os.path.exists(DATA_DIR):
+        os.makedirs(DATA_DIR, exist_ok=True)
+
+
+def load_task_history(limit=None):
+    """
+    加载任务历史
+
+    Args:
+        limit: 只返回最近的 N 条（可选）
+
+    Returns:
+        list: 按时间顺序排列的任务记录
+    """
+    if not os.path.exists(HISTORY_FILE):
+        return []
+    records = []
+    try:
+        with _file_lock:
+            with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+    except IOError as e:
+        logging.error(f"Failed to load task history: {e}")
+        return []
+    return records[-limit:] if limit else records
+
+
+def append_task_record(record):
+    """
+    追加一条任务记录
+
+    Args:
+        record: 任务记录字典
+    """
+    ensure_data_dir()
+    try:
+        with _file_lock:
+            with open(HISTORY_FILE, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        _trim_history()
+    except IOError as e:
+        logging.error(f"Failed to append task record: {e}")
+
+
+def _trim_history():
+    """文件过大时裁剪，避免每次写入都重写文件"""
+    if os.path.getsize(HISTORY_FILE) <= MAX_HISTORY_BYTES:
+        return
+    with _file_lock:
+        with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
+            f.writelines(lines[-MAX_HISTORY_RECORDS:])
+
+
+def get_user_history(user_id, limit=10):
+    """
+    获取某个用户最近的任务记录
+
+    Returns:
+        list: 最近的任务记录（新的在前）
+    """
+    records = [r for r in load_task_history() if r.get("user_id") == user_id]
+    return list(reversed(records[-limit:]))
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""
+任务调度模块
+在 allowed_user_ids 之间做加权公平排队（WFQ），支持优先级（admin/normal/background）
+与每用户并发上限，并统计每个用户的等待时间与公平性指标。
+同一批量任务的子任务合计只占用户的一个并发名额，组内另有自己的并发上限。
+紧急任务到达且没有空闲槽位时，可通过 SIGSTOP/SIGCONT 暂停低优先级任务的进程组，
+让出资源后再恢复执行。
+"""
+
+import os
+import time
+import signal
+import asyncio
+import logging
+import itertools
+from collections import defaultdict
+
+# 优先级：数值越小越优先
+PRIORITY_CLASSES = {"admin": 0, "normal": 1, "background": 2}
+PRIORITY_ALIASES = {"high": "admin", "urgent": "admin", "low": "background", "bg": "background"}
+DEFAULT_PRIORITY = "normal"
+
+# 默认调度配置（可被 config/bot_config.json 的 scheduler 段覆盖）
+DEFAULT_SCHEDULER_CONFIG = {
+    "max_concurrent_tasks": 2,
+    "per_user_max_inflight": 1,
+    "user_max_inflight": {},
+    "user_weights": {},
+    "admin_weight": 2,
+    "preemption": True,
+    "max_suspend_seconds": 600
+}
+
+_settings = dict(DEFAULT_SCHEDULER_CONFIG)
+_admin_user_id = None
+
+# 调度状态（仅在事件循环线程中访问，无需加锁）
+_queue = []  # 等待中的任务票据
+_running = []  # 执行中的任务票据
+_suspended = []  # 被抢占而暂停的任务票据
+_virtual_time = 0.0
+_user_last_finish = defaultdict(float)
+_seq = itertools.count(1)
+
+# 每用户统计
+_user_stats = defaultdict(lambda: {
+    "submitted": 0,
+    "started": 0,
+    "completed": 0,
+    "wait_total": 0.0,
+    "wait_max": 0.0,
+    "service_total": 0.0
+})
+
+
+def configure(config):
+    """
+    根据 bot 配置初始化调度参数
+
+    Args:
+        config: load_config() 返回的配置字典
+    """
+    global _settings, _admin_user_id
+    settings = dict(DEFAULT_SCHEDULER_CONFIG)
+    settings.update(config.get("scheduler") or {})
+    _settings = settings
+    _admin_user_id = config.get("admin_user_id")
+    logging.info(
+        f"Scheduler configured: max_concurrent={settings['max_concurrent_tasks']}, "
+        f"per_user_max_inflight={settings['per_user_max_inflight']}"
+    )
+
+
+def resolve_priority(requested, user_id):
+    """
+    解析用户请求的优先级
+
+    管理员默认 admin 优先级；非管理员请求 admin 时降级为 normal。
+
+    Args:
+        requested: --priority 参数值（可为 None）
+        user_id: 用户ID
+
+    Returns:
+        str: admin / normal / background
+    """
+    is_admin = _admin_user_id is not None and user_id == _admin_user_id
+    if not requested:
+        return "admin" if is_admin else DEFAULT_PRIORITY
+
+    priority = requested.strip().lower()
+    priority = PRIORITY_ALIASES.get(priority, priority)
+    if priority not in PRIORITY_CLASSES:
+        raise ValueError(f"未知优先级: {requested}（可选: admin、normal、background）")
+    if priority == "admin" and not is_admin:
+        logging.info(f"User {user_id} requested admin priority without permission, using normal")
+        return DEFAULT_PRIORITY
+    return priority
+
+
+def _user_weight(user_id):
+    weights = _settings.get("user_weights") or {}
+    weight = weights.get(str(user_id))
+    if weight is None:
+        weight = _settings["admin_weight"] if user_id == _admin_user_id else 1
+    return max(float(weight), 0.01)
+
+
+def _user_cap(user_id):
+    caps = _settings.get("user_max_inflight") or {}
+    return int(caps.get(str(user_id), _settings["per_user_max_inflight"]))
+
+
+def _inflight(user_id):
+    """用户占用的并发名额（同一批量任务的子任务合计只占一个）"""
+    groups = set()
+    count = 0
+    for t in _running:
+        if t["user_id"] != user_id:
+            continue
+        if t["group"] is None:
+            count += 1
+        elif t["group"] not in groups:
+            groups.add(t["group"])
+            count += 1
+    return count
+
+
+def _is_eligible(ticket):
+    if ticket["group"] is not None:
+        group_running = sum(1 for t in _running if t["group"] == ticket["group"])
+        if group_running:
+            return group_running < ticket["group_max_inflight"]
+    return _inflight(ticket["user_id"]) < _user_cap(ticket["user_id"])
+
+
+def _has_capacity():
+    return len(_running) < int(_settings["max_concurrent_tasks"])
+
+
+def _eligible():
+    return [t for t in _queue if _is_eligible(t)]
+
+
+def _dispatch():
+    """
+    在有空闲槽位时按（优先级, 虚拟完成时间, 提交顺序）派发任务
+
+    被暂停的任务优先于同级或更低优先级的排队任务恢复；
+    没有空闲槽位时尝试暂停一个更低优先级的执行中任务。
+    """
+    global _virtual_time
+    while True:
+        _resume_suspended()
+        eligible = _eligible()
+        if not eligible:
+            return
+        ticket = min(eligible, key=lambda t: (PRIORITY_CLASSES[t["priority"]], t["finish_tag"], t["seq"]))
+        if not _has_capacity() and not _preempt_for(ticket):
+            return
+        _queue.remove(ticket)
+        _virtual_time = max(_virtual_time, ticket["start_tag"])
+        _start(ticket)
+
+
+def _signal_group(ticket, sig):
+    """向任务的进程组发送信号，进程已退出时返回 False"""
+    if not ticket.get("pgid"):
+        return False
+    try:
+        os.killpg(ticket["pgid"], sig)
+        return True
+    except (ProcessLookupError, PermissionError) as e:
+        logging.warning(f"Failed to signal task {ticket['id']} (pgid={ticket['pgid']}): {e}")
+        return False
+
+
+def _preempt_for(ticket):
+    """为紧急任务暂停一个更低优先级的执行中任务，成功返回 True"""
+    if not _settings.get("preemption") or not hasattr(signal, "SIGSTOP"):
+        return False
+    victims = [
+        t for t in _running
+        if t.get("pgid") and PRIORITY_CLASSES[t["priority"]] > PRIORITY_CLASSES[ticket["priority"]]
+    ]
+    if not victims:
+        return False
+    # 优先暂停优先级最低、最近启动的任务
+    victim = max(victims, key=lambda t: (PRIORITY_CLASSES[t["priority"]], t["started_at"]))
+    if not _signal_group(victim, signal.SIGSTOP):
+        return False
+    _running.remove(victim)
+    victim["suspended_at"] = time.monotonic()
+    _suspended.append(victim)
+    logging.info(
+        f"Scheduler suspended task {victim['id']} (priority={victim['priority']}) "
+        f"for urgent task {ticket['id']} (priority={ticket['priority']})"
+    )
+    return True
+
+
+def _resume(ticket):
+    _suspended.remove(ticket)
+    paused = time.monotonic() - ticket["suspended_at"]
+    ticket["paused_total"] += paused
+    ticket["suspended_at"] = None
+    _running.append(ticket)
+    _signal_group(ticket, signal.SIGCONT)
+    logging.info(f"Scheduler resumed task {ticket['id']} after {paused:.1f}s suspended")
+
+
+def _resume_suspended():
+    """有空闲槽位且没有更高优先级的排队任务时恢复被暂停的任务"""
+    while _suspended and _has_capacity():
+        ticket = min(_suspended, key=lambda t: (PRIORITY_CLASSES[t["priority"]], t["suspended_at"]))
+        rank = PRIORITY_CLASSES[ticket["priority"]]
+        if any(PRIORITY_CLASSES[t["priority"]] < rank for t in _eligible()):
+            return
+        _resume(ticket)
+
+
+def _start(ticket):
+    now = time.monotonic()
+    ticket["started_at"] = now
+    _running.append(ticket)
+    wait = now - ticket["enqueued_at"]
+    stats = _user_stats[ticket["user_id"]]
+    stats["started"] += 1
+    stats["wait_total"] += wait
+    stats["wait_max"] = max(stats["wait_max"], wait)
+    if not ticket["future"].done():
+        ticket["future"].set_result(True)
+    logging.info(
+        f"Scheduler started task {ticket['id']} for user {ticket['user_id']} "
+        f"(priority={ticket['priority']}, waited {wait:.1f}s)"
+    )
+
+
+def submit(user_id, priority=DEFAULT_PRIORITY, group=None, group_max_inflight=1):
+    """
+    提交任务到调度队列（立即返回票据，若有空闲槽位会被直接派发）
+
+    Args:
+        user_id: 用户ID
+        priority: 优先级（admin / normal / background）
+        group: 批量任务标识（可选），同组子任务合计只占用户的一个并发名额
+        group_max_inflight: 同组子任务的并发上限（仍受 max_concurrent_tasks 约束）
+
+    Returns:
+        dict: 任务票据，需配合 wait_for_slot() 与 release() 使用
+    """
+    weight = _user_weight(user_id)
+    start_tag = max(_virtual_time, _user_last_finish[user_id])
+    finish_tag = start_tag + 1.0 / weight
+    _user_last_finish[user_id] = finish_tag
+
+    seq = next(_seq)
+    ticket = {
+        "id": seq,
+        "user_id": user_id,
+        "priority": priority,
+        "group": group,
+        "group_max_inflight": max(int(group_max_inflight), 1),
+        "weight": weight,
+        "start_tag": start_tag,
+        "finish_tag": finish_tag,
+        "seq": seq,
+        "enqueued_at": time.monotonic(),
+        "started_at": None,
+        "pgid": None,
+        "suspended_at": None,
+        "paused_total": 0.0,
+        "future": asyncio.get_running_loop().create_future()
+    }
+    _user_stats[user_id]["submitted"] += 1
+    _queue.append(ticket)
+    _dispatch()
+    return ticket
+
+
+def queue_position(ticket):
+    """
+    返回票据前面还有多少个会先于它执行的任务，已在执行时返回 0
+    """
+    if ticket["started_at"] is not None:
+        return 0
+    key = (PRIORITY_CLASSES[ticket["priority"]], ticket["finish_tag"], ticket["seq"])
+    return sum(
+        1 for t in _queue
+        if (PRIORITY_CLASSES[t["priority"]], t["finish_tag"], t["seq"]) < key
+    )
+
+
+async def wait_for_slot(ticket):
+    """等待票据被派发；若等待期间被取消则从队列中移除"""
+    try:
+        await ticket["future"]
+    except asyncio.CancelledError:
+        if ticket in _queue:
+            _queue.remove(ticket)
+        else:
+            release(ticket)
+        raise
+
+
+def attach_process(ticket, process):
+    """
+    关联任务的子进程，使其可被抢占（子进程需以 start_new_session=True 启动）
+
+    Args:
+        ticket: submit() 返回的票据
+        process: subprocess.Popen 对象
+    """
+    try:
+        ticket["pgid"] = os.getpgid(process.pid)
+    except (AttributeError, ProcessLookupError):
+        ticket["pgid"] = None
+
+
+def is_suspended(ticket):
+    """任务当前是否被暂停"""
+    return ticket["suspended_at"] is not None
+
+
+def paused_seconds(ticket):
+    """任务累计被暂停的秒数（含当前这次暂停）"""
+    total = ticket["paused_total"]
+    if ticket["suspended_at"] is not None:
+        total += time.monotonic() - ticket["suspended_at"]
+    return total
+
+
+def enforce_suspend_limit(ticket):
+    """
+    暂停时间超过 max_suspend_seconds 时强制恢复任务（即使会超出并发上限）
+
+    Returns:
+        bool: 本次是否触发了强制恢复
+    """
+    if ticket not in _suspended:
+        return False
+    if time.monotonic() - ticket["suspended_at"] < float(_settings["max_suspend_seconds"]):
+        return False
+    logging.warning(f"Task {ticket['id']} exceeded max suspend time, resuming anyway")
+    _resume(ticket)
+    return True
+
+
+def release(ticket):
+    """任务结束后释放槽位并派发后续任务（可重复调用）"""
+    if ticket in _queue:
+        _queue.remove(ticket)
+    elif ticket in _running or ticket in _suspended:
+        if ticket in _suspended:
+            _resume(ticket)
+        _running.remove(ticket)
+        ticket["pgid"] = None
+        service = time.monotonic() - ticket["started_at"] - ticket["paused_total"]
+        stats = _user_stats[ticket["user_id"]]
+        stats["completed"] += 1
+        stats["service_total"] += service
+    _dispatch()
+
+
+def _jain_index(values):
+    """Jain 公平性指数：1.0 表示完全公平"""
+    values = [v for v in values if v > 0]
+    if not values:
+        return 1.0
+    return sum(values) ** 2 / (len(values) * sum(v * v for v in values))
+
+
+def get_scheduler_stats():
+    """
+    返回调度器运行状态与每用户统计
+
+    Returns:
+        dict: running / queued / capacity / fairness_index / users
+    """
+    users = {}
+    for user_id, stats in _user_stats.items():
+        started = stats["started"]
+        users[user_id] = {
+            "submitted": stats["submitted"],
+            "completed": stats["completed"],
+            "inflight": sum(1 for t in _running if t["user_id"] == user_id),
+            "queued": sum(1 for t in _queue if t["user_id"] == user_id),
+            "avg_wait": stats["wait_total"] / started if started else 0.0,
+            "max_wait": stats["wait_max"],
+            "service_total": stats["service_total"],
+            "weight": _user_weight(user_id)
+        }
+    fairness = _jain_index([u["service_total"] / u["weight"] for u in users.values()])
+    return {
+        "running": len(_running),
+        "suspended": len(_suspended),
+        "queued": len(_queue),
+        "capacity": int(_settings["max_concurrent_tasks"]),
+        "fairness_index": fairness,
+        "users": users
+    }
+
+
+def format_scheduler_stats():
+    """
+    格式化调度统计，用于 /queue 命令回复
+
+    Returns:
+        str: 可读的统计文本
+    """
+    stats = get_scheduler_stats()
+    lines = [
+        f"📋 任务队列：执行中 {stats['running']}/{stats['capacity']}，已暂停 {stats['suspended']}，排队 {stats['queued']}",
+        f"⚖️ 公平性指数：{stats['fairness_index']:.2f}"
+    ]
+    for user_id, u in sorted(stats["users"].items(), key=lambda item: str(item[0])):
+        lines.append(
+            f"- {user_id}: 执行中 {u['inflight']}，排队 {u['queued']}，已完成 {u['completed']}，"
+            f"平均等待 {u['avg_wait']:.1f}秒，最长等待 {u['max_wait']:.1f}秒"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+agent 任务监管进程
+由 Bot 以独立会话启动，stdout/stderr 已重定向到任务目录中的文件。
+运行 agent 并等待其结束，将退出码与资源使用原子写入 exit.json，
+使 Bot 重启后仍能取得任务结果。
+
+资源限制（cgroup 与 RLIMIT）由本进程在启动 agent 前施加于自身，agent 继承这些限制。
+
+用法：
+    task_supervisor.py <task_dir> [--limits <JSON>] -- <agent 命令...>
+
+--limits 为 {"memory_mb": ..., "cpu_seconds": ..., "cgroup_path": ...}
+"""
+
+import os
+import sys
+import json
+import signal
+import subprocess
+
+import resource_limits
+
+EXIT_FILE_NAME = "exit.json"
+
+
+def write_exit_status(task_dir, code, usage):
+    """原子写入退出状态"""
+    exit_file = os.path.join(task_dir, EXIT_FILE_NAME)
+    tmp_file = exit_file + ".tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump({"code": code, "usage": usage}, f)
+    os.replace(tmp_file, exit_file)
+
+
+def main():
+    args = sys.argv[1:]
+    limits = {}
+    if len(args) >= 3 and args[1] == "--limits":
+        limits = json.loads(args[2])
+        del args[1:3]
+    if len(args) < 3 or args[1] != "--":
+        print("usage: task_supervisor.py <task_dir> [--limits <json>] -- <command...>", file=sys.stderr)
+        sys.exit(2)
+    task_dir = args[0]
+    cmd = args[2:]
+
+    # Bot 进程退出或终端关闭时不影响任务
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    try:
+        resource_limits.apply_limits(limits, limits.get("cgroup_path"))
+    except (OSError, ValueError) as e:
+        print(f"Failed to apply resource limits: {e}", file=sys.stderr)
+        write_exit_status(task_dir, 126, None)
+        sys.exit(126)
+
+    try:
+        # agent 继承本进程的 stdout/stderr（任务目录中的文件）、进程组与资源限制
+        process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL)
+    except OSError as e:
+        print(f"Failed to start agent: {e}", file=sys.stderr)
+        write_exit_status(task_dir, 127, None)
+        sys.exit(127)
+
+    if hasattr(os, "wait4"):
+        while True:
+            try:
+                _, status, rusage = os.wait4(process.pid, 0)
+                break
+            except InterruptedError:
+                continue
+        code = os.waitstatus_to_exitcode(status)
+    else:
+        code, rusage = process.wait(), None
+
+    write_exit_status(task_dir, code, resource_limits.usage_from_rusage(rusage))
+
+
+if __name__ == "__main__":
+    main()
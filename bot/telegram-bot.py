@@ -10,12 +10,12 @@ import re
 import subprocess
 import logging
 import asyncio
-import threading
+import uuid
 from datetime import datetime, timedelta
 from collections import defaultdict
 from dotenv import load_dotenv
 from telegram import Update
-from telegram.ext import Application, MessageHandler, filters, ContextTypes
+from telegram.ext import Application, CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes
 from telegram.request import HTTPXRequest
 
 # 导入项目管理和会话管理模块
@@ -29,8 +29,23 @@ from session_manager import (
     get_user_project,
     set_user_project,
     clear_user_project,
-    cleanup_expired_sessions
+    cleanup_expired_sessions,
+    get_agent_chat,
+    set_agent_chat,
+    clear_agent_chat
 )
+import task_scheduler
+from task_scheduler import PRIORITY_CLASSES, PRIORITY_ALIASES
+import resource_limits
+import task_history
+import profiler
+import admission
+import project_index
+import model_router
+import eta_predictor
+import update_backlog
+import detached_tasks
+import health_monitor
 
 # 加载环境变量
 load_dotenv()
@@ -78,6 +93,9 @@ AGENT_PATH = _get_agent_path()
 
 # 速率限制
 RATE_LIMIT = {"max_messages": 5, "window_seconds": 60}
+
+# 批量任务（一条消息拆分为多个并行子任务）的默认最大子任务数
+MAX_BATCH_ITEMS = 5
 user_message_times = defaultdict(list)
 
 # 项目触发词映射（全局变量，在初始化时填充）
@@ -225,37 +243,91 @@ def parse_task_message(message, user_id=None):
     task = {
         "description": "",
         "projectPath": PROJECT_ROOT,
-        "model": "auto"
+        "model": "auto",
+        "priority": None
     }
     
-    # 提取项目路径
-    project_match = re.search(r'--project[:\s]+([^\s]+)', message, re.IGNORECASE)
-    if project_match:
-        project_spec = project_match.group(1)
-        # 检查是否是项目名称（在 allowed_projects 中）
-        allowed_projects = config.get("allowed_projects", {})
-        if project_spec in allowed_projects:
-            task["projectPath"] = allowed_projects[project_spec]
-        else:
-            # 直接使用路径（可能是完整路径）
-            task["projectPath"] = project_spec
+    # 提取项目路径（可以出现多次，多个项目时拆分为批量任务）
+    allowed_projects = config.get("allowed_projects", {})
+    project_paths = []
+    for project_spec in re.findall(r'--project[:\s]+([^\s]+)', message, re.IGNORECASE):
+        # 检查是否是项目名称（在 allowed_projects 中），否则直接使用路径（可能是完整路径）
+        project_path = allowed_projects.get(project_spec, project_spec)
+        if project_path not in project_paths:
+            project_paths.append(project_path)
+    if project_paths:
+        task["projectPath"] = project_paths[0]
     
     # 提取模型
     model_match = re.search(r'--model[:\s]+([^\s]+)', message, re.IGNORECASE)
     if model_match:
         task["model"] = model_match.group(1)
     
+    # 提取优先级（admin / normal / background）
+    priority_match = re.search(r'--priority[:\s]+([^\s]+)', message, re.IGNORECASE)
+    if priority_match:
+        priority = priority_match.group(1).lower()
+        if PRIORITY_ALIASES.get(priority, priority) not in PRIORITY_CLASSES:
+            raise ValueError(f"未知优先级: {priority_match.group(1)}（可选: admin、normal、background）")
+        task["priority"] = priority_match.group(1)
+    
     # 提取任务描述（移除参数部分）
     description = message
     description = re.sub(r'--project[:\s]+[^\s]+', '', description, flags=re.IGNORECASE)
     description = re.sub(r'--model[:\s]+[^\s]+', '', description, flags=re.IGNORECASE)
+    description = re.sub(r'--priority[:\s]+[^\s]+', '', description, flags=re.IGNORECASE)
+    description = re.sub(r'--batch\b', '', description, flags=re.IGNORECASE)
     description = re.sub(r'^(执行任务|任务|do|run)[：:]\s*', '', description, flags=re.IGNORECASE)
     description = description.strip()
     
     task["description"] = description or message
     
+    # 4. 批量任务：多个 --project 和/或 --batch 时的编号列表（1. xxx 2. yyy）
+    # 未指定 --batch 的编号列表视为按顺序执行的步骤，交给同一个 agent
+    batch_requested = re.search(r'--batch\b', message, re.IGNORECASE) is not None
+    subtasks = split_numbered_subtasks(task["description"]) if batch_requested else []
+    if len(project_paths) > 1 or len(subtasks) > 1:
+        task["batch"] = [
+            {
+                "description": subtask,
+                "projectPath": project_path,
+                "model": task["model"],
+                "priority": task["priority"]
+            }
+            for project_path in (project_paths or [task["projectPath"]])
+            for subtask in (subtasks or [task["description"]])
+        ]
+        max_items = config.get("max_batch_items", MAX_BATCH_ITEMS)
+        if len(task["batch"]) > max_items:
+            raise ValueError(f"批量任务过多（{len(task['batch'])} 项，最多 {max_items} 项）")
+    
     return task
 
+def split_numbered_subtasks(description):
+    """
+    将编号列表形式的描述拆分为多个子任务
+
+    编号行之外的文字作为公共说明拼接到每个子任务前面。
+
+    Args:
+        description: 任务描述
+
+    Returns:
+        list: 子任务描述列表；少于 2 个编号项时返回空列表
+    """
+    common_lines = []
+    subtasks = []
+    for line in description.splitlines():
+        item_match = re.match(r'^\s*\d+[.)、．]\s*(.+)$', line)
+        if item_match:
+            subtasks.append(item_match.group(1).strip())
+        elif line.strip():
+            common_lines.append(line.strip())
+    if len(subtasks) < 2:
+        return []
+    common = " ".join(common_lines)
+    return [f"{common} {subtask}" if common else subtask for subtask in subtasks]
+
 def parse_cursor_output(output_text):
     """解析 Cursor CLI 的 JSON 输出并格式化"""
     try:
@@ -302,7 +374,8 @@ def parse_cursor_output(output_text):
                 "output": formatted_output,
                 "raw_output": output_text,
                 "is_error": is_error,
-                "duration_ms": duration_ms
+                "duration_ms": duration_ms,
+                "duration_api_ms": duration_api_ms
             }
         else:
             # 如果没有找到 result 对象，返回所有解析的内容
@@ -327,22 +400,87 @@ def parse_cursor_output(output_text):
             "is_error": False
         }
 
-async def execute_cursor_cli(task_description, project_path, model, user_id, username, progress_callback=None):
+# agent 提示对话不存在时的输出特征（此时清除记录的对话ID，下次任务开始新对话）
+_STALE_CHAT_PATTERNS = r'chat.{0,20}(not found|does not exist|invalid)|unknown chat|no such chat'
+
+def build_agent_env():
+    """agent 子进程的环境变量（包括代理）"""
+    env = os.environ.copy()
+    env["HTTP_PROXY"] = env.get("HTTP_PROXY", "http://127.0.0.1:7890")
+    env["HTTPS_PROXY"] = env.get("HTTPS_PROXY", "http://127.0.0.1:7890")
+    env["NO_PROXY"] = "localhost,127.0.0.1"
+    return env
+
+def create_agent_chat(project_path):
+    """
+    通过 agent create-chat 创建新对话（阻塞调用，需在线程中执行）
+    
+    Returns:
+        str: 对话ID；创建失败时返回 None
+    """
+    try:
+        result = subprocess.run(
+            [AGENT_PATH, "create-chat"],
+            cwd=project_path or None,
+            capture_output=True,
+            text=True,
+            env=build_agent_env(),
+            timeout=30
+        )
+    except (subprocess.TimeoutExpired, OSError) as e:
+        logging.warning(f"Failed to create agent chat: {e}")
+        return None
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not lines:
+        logging.warning(f"agent create-chat failed with code {result.returncode}: {result.stderr.strip()[:200]}")
+        return None
+    return lines[-1].strip()
+
+async def resolve_agent_chat(user_id, project_path):
+    """
+    获取用户在该项目上的 agent 对话，没有时创建新对话
+    
+    Returns:
+        tuple: (chat_id, resumed)；创建失败时 chat_id 为 None（任务将以无上下文方式执行）
+    """
+    chat_id = get_agent_chat(user_id, project_path)
+    if chat_id:
+        return chat_id, True
+    chat_id = await asyncio.to_thread(create_agent_chat, project_path)
+    if chat_id:
+        set_agent_chat(user_id, project_path, chat_id)
+    return chat_id, False
+
+async def execute_cursor_cli(task_description, project_path, model, user_id, username, progress_callback=None, ticket=None, eta=None, chat_id=None, reply_to_message_id=None, agent_chat_id=None, on_spawned=None):
     """
     安全执行 Cursor CLI，支持增量输出
     
+    agent 在独立会话中由监管进程运行，输出写入 data/tasks/<id>/，Bot 重启不会中断任务，
+    重启后由 resume_detached_task() 接管并把结果发送到 chat_id。
+    
     Args:
         task_description: 任务描述
         project_path: 项目路径（工作目录）
         model: 模型名称
         user_id: 用户ID
         username: 用户名
-        progress_callback: 进度回调函数，每30秒调用一次，参数为 (incremental_output, total_output)
+        progress_callback: 进度回调函数，默认每30秒调用一次，参数为 (incremental_output, total_output)
+        ticket: 调度器票据（可选），提供时子进程可被更高优先级任务暂停/恢复
+        eta: eta_predictor.predict() 的结果（可选），用于调整推送频率并标记疑似卡住的任务
+        chat_id: 任务所属聊天（可选），Bot 重启后向此聊天发送结果
+        reply_to_message_id: 重启后发送结果时回复的消息ID（可选）
+        agent_chat_id: 要继续的 agent 对话ID（可选），通过 --resume 传给 agent
+        on_spawned: agent 启动后调用的函数（可选），此后任务由 detached_tasks 负责在重启后接管
     """
     try:
         # 验证输入
         validated_task = validate_task_input(task_description)
         
+        # 代理或 agent 熔断时立即失败，不再启动注定失败或卡住的 agent
+        unavailable = health_monitor.check_task_dependencies()
+        if unavailable:
+            raise RuntimeError(f"依赖不可用，任务未执行：{unavailable}")
+        
         # 记录操作
         logging.info(f"User {user_id} ({username}) executing: {validated_task[:100]}")
         logging.info(f"Working directory: {project_path}")
@@ -354,149 +492,53 @@ async def execute_cursor_cli(task_description, project_path, model, user_id, use
             AGENT_PATH,
             "--model", model,
             "-p",
-            "--force",
-            validated_task
+            "--force"
         ]
+        if agent_chat_id:
+            # 继续同一对话，agent 无需重新了解代码库与之前的交流
+            cmd += ["--resume", agent_chat_id]
+        cmd.append(validated_task)
         
         # 配置环境变量（包括代理）
-        env = os.environ.copy()
-        env["HTTP_PROXY"] = env.get("HTTP_PROXY", "http://127.0.0.1:7890")
-        env["HTTPS_PROXY"] = env.get("HTTPS_PROXY", "http://127.0.0.1:7890")
-        env["NO_PROXY"] = "localhost,127.0.0.1"
-        
-        # 使用 Popen 以便实时读取输出（project_path 为空时使用当前目录）
-        process = subprocess.Popen(
-            cmd,
-            cwd=project_path or None,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            env=env,
-            bufsize=1  # 行缓冲
-        )
-        
-        stdout_buffer = []
-        stderr_buffer = []
-        last_sync_time = datetime.now()
-        sync_interval = timedelta(seconds=30)  # 30秒同步一次
-        last_sent_stdout_len = 0  # 记录上次发送的 stdout 长度
-        last_sent_stderr_len = 0  # 记录上次发送的 stderr 长度
-        
-        # 读取输出的线程函数
-        def read_output(pipe, buffer):
-            try:
-                for line in iter(pipe.readline, ''):
-                    if line:
-                        buffer.append(line)
-                        logging.info(f"CLI output received: {line[:200]}")  # 改为 INFO 级别以便调试
-            except Exception as e:
-                logging.error(f"Error reading output: {e}")
-            finally:
-                pipe.close()
-        
-        # 启动读取线程
-        stdout_thread = threading.Thread(target=read_output, args=(process.stdout, stdout_buffer))
-        stderr_thread = threading.Thread(target=read_output, args=(process.stderr, stderr_buffer))
-        stdout_thread.daemon = True
-        stderr_thread.daemon = True
-        stdout_thread.start()
-        stderr_thread.start()
-        
-        # 等待进程完成，同时每30秒同步一次增量输出
-        start_time = datetime.now()
-        while process.poll() is None:
-            await asyncio.sleep(1)  # 每秒检查一次
-            
-            # 检查是否到了同步时间
-            now = datetime.now()
-            if progress_callback and (now - last_sync_time) >= sync_interval:
-                # 获取当前全部输出
-                current_stdout = ''.join(stdout_buffer)
-                current_stderr = ''.join(stderr_buffer)
-                
-                # 计算增量部分（只发送新增的内容）
-                incremental_stdout = current_stdout[last_sent_stdout_len:]
-                incremental_stderr = current_stderr[last_sent_stderr_len:]
-                
-                # 更新已发送的长度
-                last_sent_stdout_len = len(current_stdout)
-                last_sent_stderr_len = len(current_stderr)
-                
-                # 构建增量输出
-                incremental_output = ""
-                if incremental_stdout:
-                    # 对于增量输出，直接使用原始文本（不解析 JSON，因为可能是部分输出）
-                    incremental_output = incremental_stdout.strip()
-                
-                if incremental_stderr:
-                    if incremental_output:
-                        incremental_output += f"\n\n⚠️ 警告/错误:\n{incremental_stderr.strip()}"
-                    else:
-                        incremental_output = f"⚠️ 警告/错误:\n{incremental_stderr.strip()}"
-                
-                # 固定每10秒发送一次消息
-                elapsed = (now - start_time).total_seconds()
-                try:
-                    if incremental_output:
-                        # 有新输出，发送新输出
-                        incremental_output = filter_sensitive_info(incremental_output)
-                        logging.info(f"Sending incremental update after {elapsed:.1f}s, stdout_len={len(incremental_stdout)}, stderr_len={len(incremental_stderr)}")
-                        await progress_callback(incremental_output, elapsed)
-                    else:
-                        # 没有新输出，发送"正在处理中"
-                        logging.info(f"No new output after {elapsed:.1f}s, sending progress ping")
-                        await progress_callback("⏳ 正在处理中，请稍候...", elapsed)
-                except Exception as e:
-                    logging.error(f"Error in progress callback: {e}")
-                
-                last_sync_time = now
-        
-        # 等待读取线程完成
-        stdout_thread.join(timeout=5)
-        stderr_thread.join(timeout=5)
+        env = build_agent_env()
         
-        # 获取最终输出
-        final_stdout = ''.join(stdout_buffer)
-        final_stderr = ''.join(stderr_buffer)
-        return_code = process.returncode
+        # 资源限制：cgroup v2 配额（可用时）或 RLIMIT，由监管进程在启动 agent 前施加
+        task_id = uuid.uuid4().hex[:12]
+        limits = resource_limits.get_resource_limits(load_config())
+        cgroup_path = resource_limits.create_task_cgroup(task_id, limits)
         
-        # 记录结果
-        logging.info(f"Task completed with code {return_code}")
-        
-        # 解析和格式化输出
-        # 注意：由于不再使用 --output-format json，输出格式可能不同
-        if return_code == 0 and final_stdout:
-            # 尝试解析 JSON（如果输出是 JSON 格式）
-            try:
-                parsed_result = parse_cursor_output(final_stdout)
-                # 过滤敏感信息
-                parsed_result["output"] = filter_sensitive_info(parsed_result["output"])
-                return {
-                    "success": parsed_result["success"],
-                    "output": parsed_result["output"],
-                    "error": filter_sensitive_info(final_stderr) if final_stderr else "",
-                    "code": return_code,
-                    "duration_ms": parsed_result.get("duration_ms", 0)
+        # 通过监管进程在独立会话/进程组中启动（project_path 为空时使用当前目录），
+        # 输出写入任务目录中的文件；抢占时整组 SIGSTOP/SIGCONT
+        with profiler.span("spawn"):
+            process, task = detached_tasks.spawn_task(
+                task_id,
+                cmd,
+                project_path or None,
+                env,
+                {
+                    "memory_mb": limits.get("memory_mb"),
+                    "cpu_seconds": limits.get("cpu_seconds"),
+                    "cgroup_path": cgroup_path
+                },
+                {
+                    "chat_id": chat_id,
+                    "reply_to_message_id": reply_to_message_id,
+                    "user_id": user_id,
+                    "username": username,
+                    "project_path": project_path,
+                    "model": model,
+                    "description": validated_task,
+                    "cgroup_path": cgroup_path,
+                    "eta": eta,
+                    "agent_chat_id": agent_chat_id
                 }
-            except Exception as e:
-                # 如果解析失败，直接使用原始输出
-                logging.warning(f"Failed to parse output as JSON, using raw output: {e}")
-                return {
-                    "success": True,
-                    "output": filter_sensitive_info(final_stdout),
-                    "error": filter_sensitive_info(final_stderr) if final_stderr else "",
-                    "code": return_code,
-                    "duration_ms": 0
-                }
-        else:
-            # 执行失败或没有输出
-            error_msg = filter_sensitive_info(final_stderr) if final_stderr else "任务执行失败，无错误信息"
-            return {
-                "success": False,
-                "output": "",
-                "error": error_msg,
-                "code": return_code
-            }
+            )
+        if ticket:
+            task_scheduler.attach_process(ticket, process)
+        if on_spawned:
+            on_spawned()
+        
+        return await follow_cursor_task(task, process, progress_callback=progress_callback, ticket=ticket, eta=eta)
         
     except ValueError as e:
         logging.warning(f"Input validation failed: {e}")
@@ -508,7 +550,230 @@ async def execute_cursor_cli(task_description, project_path, model, user_id, use
         logging.error(f"Execution error: {e}")
         raise
 
+async def follow_cursor_task(task, process=None, progress_callback=None, ticket=None, eta=None):
+    """
+    跟踪任务输出文件直到任务结束，返回结果
+    
+    Args:
+        task: detached_tasks 的任务状态字典
+        process: 监管进程的 Popen 对象；重启后接管的任务为 None
+        progress_callback: 进度回调函数，参数为 (incremental_output, elapsed_seconds)
+        ticket: 调度器票据（可选）
+        eta: eta_predictor.predict() 的结果（可选）
+    """
+    project_path = task["project_path"]
+    model = task["model"]
+    validated_task = task["description"]
+    cgroup_path = task.get("cgroup_path")
+    
+    last_sync_time = datetime.now()
+    overdue_notified = False
+    
+    # 等待进程完成，同时按预测耗时调整的间隔同步增量输出（无预测时每30秒）
+    start_time = datetime.fromtimestamp(task["started_at"])
+    was_paused = False
+    while True:
+        # 监管进程结束时会记录 agent 的退出码与 CPU/内存/I/O 统计
+        return_code, exit_usage = detached_tasks.poll_task(task, process)
+        if return_code is not None:
+            break
+        await asyncio.sleep(1)  # 每秒检查一次
+        
+        # 被抢占暂停期间不发送进度，只在暂停/恢复时各通知一次
+        now = datetime.now()
+        if ticket:
+            task_scheduler.enforce_suspend_limit(ticket)
+            paused = task_scheduler.is_suspended(ticket)
+            if paused != was_paused:
+                was_paused = paused
+                elapsed = (now - start_time).total_seconds() - task_scheduler.paused_seconds(ticket)
+                if progress_callback:
+                    try:
+                        if paused:
+                            await progress_callback("⏸️ 任务已暂停：正在为更高优先级的任务让出资源，稍后自动恢复", elapsed)
+                        else:
+                            await progress_callback("▶️ 任务已恢复执行", elapsed)
+                    except Exception as e:
+                        logging.error(f"Error in progress callback: {e}")
+                last_sync_time = now
+            if paused:
+                continue
+        
+        # 已执行时间不含暂停时长
+        elapsed = (now - start_time).total_seconds()
+        if ticket:
+            elapsed -= task_scheduler.paused_seconds(ticket)
+        
+        # 超过历史 p99 时提示可能卡住（只提示一次）
+        if progress_callback and not overdue_notified and eta_predictor.is_overdue(elapsed, eta):
+            overdue_notified = True
+            logging.warning(f"Task exceeded p99 duration ({eta['p99']:.0f}s), probably hung")
+            try:
+                await progress_callback(
+                    f"⚠️ 已超过历史 p99 耗时（约 {format_elapsed(eta['p99'])}），任务可能已卡住",
+                    elapsed
+                )
+            except Exception as e:
+                logging.error(f"Error in progress callback: {e}")
+        
+        # 检查是否到了同步时间
+        sync_interval = timedelta(seconds=eta_predictor.next_progress_interval(elapsed, eta))
+        if progress_callback and (now - last_sync_time) >= sync_interval:
+            # 从上次推送的偏移读取增量部分（只发送新增的内容），并持久化偏移以便重启后续传
+            incremental_stdout = detached_tasks.read_new_output(task, "stdout")
+            incremental_stderr = detached_tasks.read_new_output(task, "stderr")
+            detached_tasks.save_state(task)
+            
+            # 构建增量输出
+            incremental_output = ""
+            if incremental_stdout:
+                # 对于增量输出，直接使用原始文本（不解析 JSON，因为可能是部分输出）
+                incremental_output = incremental_stdout.strip()
+            
+            if incremental_stderr:
+                if incremental_output:
+                    incremental_output += f"\n\n⚠️ 警告/错误:\n{incremental_stderr.strip()}"
+                else:
+                    incremental_output = f"⚠️ 警告/错误:\n{incremental_stderr.strip()}"
+            
+            try:
+                if incremental_output:
+                    # 有新输出，发送新输出
+                    incremental_output = filter_sensitive_info(incremental_output)
+                    logging.info(f"Sending incremental update after {elapsed:.1f}s, stdout_len={len(incremental_stdout)}, stderr_len={len(incremental_stderr)}")
+                    await progress_callback(incremental_output, elapsed)
+                else:
+                    # 没有新输出，发送"正在处理中"
+                    logging.info(f"No new output after {elapsed:.1f}s, sending progress ping")
+                    await progress_callback("⏳ 正在处理中，请稍候...", elapsed)
+            except Exception as e:
+                logging.error(f"Error in progress callback: {e}")
+            
+            last_sync_time = now
+    
+    # 获取最终输出
+    final_stdout = detached_tasks.read_output(task, "stdout")
+    final_stderr = detached_tasks.read_output(task, "stderr")
+    
+    # 资源统计：优先使用覆盖整个进程树的 cgroup 数据
+    config = load_config()
+    limits = resource_limits.get_resource_limits(config)
+    usage = resource_limits.read_cgroup_usage(cgroup_path) or exit_usage
+    resource_limits.remove_task_cgroup(cgroup_path)
+    killed_reason = resource_limits.detect_limit_kill(return_code, limits, usage, final_stderr)
+    wall_seconds = (datetime.now() - start_time).total_seconds()
+    if ticket:
+        wall_seconds -= task_scheduler.paused_seconds(ticket)
+    
+    # 记录结果
+    logging.info(f"Task {task['task_id']} completed with code {return_code}, usage: {usage}")
+    
+    # agent 无法启动（监管进程以 127 退出）时立即熔断，后续任务快速失败
+    if return_code == 127:
+        health_monitor.record_failure("agent", f"无法启动 agent：{final_stderr.strip()[:200]}", trip=True)
+    elif return_code == 0:
+        health_monitor.record_success("agent")
+    
+    # 记录的对话已失效时清除，下次任务开始新对话
+    stale_chat = bool(
+        return_code != 0 and task.get("agent_chat_id") and re.search(_STALE_CHAT_PATTERNS, final_stderr, re.IGNORECASE)
+    )
+    if stale_chat:
+        logging.warning(f"Agent chat {task['agent_chat_id']} is no longer available, clearing it")
+        clear_agent_chat(task["user_id"], project_path)
+    
+    # 解析和格式化输出
+    # 注意：由于不再使用 --output-format json，输出格式可能不同
+    if return_code == 0 and final_stdout:
+        # 尝试解析 JSON（如果输出是 JSON 格式）
+        try:
+            parsed_result = parse_cursor_output(final_stdout)
+            # 过滤敏感信息
+            parsed_result["output"] = filter_sensitive_info(parsed_result["output"])
+            result = {
+                "success": parsed_result["success"],
+                "output": parsed_result["output"],
+                "error": filter_sensitive_info(final_stderr) if final_stderr else "",
+                "code": return_code,
+                "duration_ms": parsed_result.get("duration_ms", 0),
+                "duration_api_ms": parsed_result.get("duration_api_ms", 0)
+            }
+        except Exception as e:
+            # 如果解析失败，直接使用原始输出
+            logging.warning(f"Failed to parse output as JSON, using raw output: {e}")
+            result = {
+                "success": True,
+                "output": filter_sensitive_info(final_stdout),
+                "error": filter_sensitive_info(final_stderr) if final_stderr else "",
+                "code": return_code,
+                "duration_ms": 0
+            }
+    else:
+        # 执行失败或没有输出
+        error_msg = filter_sensitive_info(final_stderr) if final_stderr else "任务执行失败，无错误信息"
+        if killed_reason:
+            error_msg = f"💥 killed: {killed_reason}\n\n{error_msg}"
+        if stale_chat:
+            error_msg = f"💬 之前的对话已失效，已重置，请重新发送任务\n\n{error_msg}"
+        result = {
+            "success": False,
+            "output": "",
+            "error": error_msg,
+            "code": return_code
+        }
+    
+    result["usage"] = usage
+    result["killed_reason"] = killed_reason
+    bucket = model_router.size_bucket(validated_task)
+    model_router.record_result(
+        model,
+        project_path,
+        bucket,
+        (result.get("duration_ms") or wall_seconds * 1000) / 1000,
+        result["success"],
+        window=model_router.get_routing_settings(config)["window"]
+    )
+    if result["success"]:
+        eta_predictor.record(project_path, model, bucket, wall_seconds)
+    task_history.append_task_record({
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "user_id": task["user_id"],
+        "project_path": project_path,
+        "model": model,
+        "description": validated_task[:200],
+        "size_bucket": bucket,
+        "success": result["success"],
+        "code": return_code,
+        "duration_ms": result.get("duration_ms", 0),
+        "duration_api_ms": result.get("duration_api_ms", 0),
+        "wall_seconds": round(wall_seconds, 3),
+        "killed_reason": killed_reason,
+        "usage": usage
+    })
+    # 结果先写入任务目录，送达后再由调用方删除；送达前 Bot 重启时由 resume_detached_task() 补发
+    result["task_id"] = task["task_id"]
+    task["result"] = result
+    detached_tasks.save_state(task)
+    return result
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理消息（记录各处理阶段耗时）"""
+    trace = profiler.start_trace(f"message:{update.update_id}")
+    # 交给 agent 或回复之前 Bot 重启时，下次启动会重放这条消息
+    update_backlog.track_update(update)
+    cancelled = False
+    try:
+        await _handle_message(update, context)
+    except asyncio.CancelledError:
+        # Bot 停止时仍在排队或等待合并的消息保留，下次启动时重放
+        cancelled = True
+        raise
+    finally:
+        if not cancelled:
+            update_backlog.mark_processed(update.update_id)
+        profiler.finish_trace(trace)
+
+async def _handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """处理消息"""
     user_id = update.effective_user.id
     username = update.effective_user.username or "unknown"
@@ -520,6 +785,11 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     message_text = update.message.text if update.message.text else ""
     
+    # 积压消息固定在它发送时所在的项目（启动时项目切换会先于任务处理）
+    pinned_project = update_backlog.pop_pinned_project(update.update_id)
+    if pinned_project:
+        message_text = f"--project {pinned_project} {message_text}"
+    
     # 记录收到的消息
     logging.info(f"Received message from user {user_id} ({username}): {message_text[:100]}")
     
@@ -533,7 +803,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # 1. 用户认证
-    if not is_user_allowed(user_id):
+    with profiler.span("auth"):
+        allowed = is_user_allowed(user_id)
+    if not allowed:
         logging.warning(f"Unauthorized access attempt from user {user_id} ({username})")
         try:
             await update.message.reply_text("❌ 未授权访问\n\n你的 User ID 不在白名单中。请联系管理员添加。")
@@ -541,8 +813,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             logging.error(f"Failed to send unauthorized message: {e}")
         return
     
-    # 2. 速率限制
-    if not check_rate_limit(user_id):
+    # 2. 速率限制（离线期间积压的消息不计入）
+    with profiler.span("rate_limit"):
+        within_limit = update_backlog.is_backlog_update(update.update_id) or check_rate_limit(user_id)
+    if not within_limit:
         logging.info(f"Rate limit exceeded for user {user_id}")
         try:
             await update.message.reply_text("⚠️ 请求过于频繁，请稍后再试\n\n速率限制：每分钟最多 5 条消息")
@@ -552,7 +826,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # 3. 检查是否为触发词（项目切换）
     try:
-        parsed = parse_task_message(message_text, user_id)
+        with profiler.span("parse"):
+            parsed = parse_task_message(message_text, user_id)
     except Exception as e:
         logging.warning(f"Task parsing failed: {e}")
         try:
@@ -565,10 +840,13 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if parsed and parsed.get("type") == "switch_project":
         trigger_word = parsed["trigger_word"]
         project_path = parsed["project_path"]
+        project_name = project_index.find_project_name(project_path)
+        status_line = f"状态：{project_index.format_project_status(project_name)}\n" if project_name else ""
         try:
             await update.message.reply_text(
                 f"✅ 已切换到项目：{trigger_word}\n"
-                f"路径：{project_path}\n\n"
+                f"路径：{project_path}\n"
+                f"{status_line}\n"
                 f"后续消息将自动使用此项目。"
             )
         except Exception as e:
@@ -576,7 +854,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # 4. 检查是否有记忆的项目（如果不是切换操作）
-    user_project = get_user_project(user_id)
+    with profiler.span("session_lookup"):
+        user_project = get_user_project(user_id)
     if not user_project:
         # 生成项目列表提示
         project_list = "\n".join(get_project_display_list())
@@ -592,12 +871,88 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 5. 解析任务（此时已确保有记忆的项目）
     task = parsed
     
-    # 6. 执行任务
+    # 6. 准入控制：队列超过高水位时提前拒绝
+    config = load_config()
+    wait_minutes = admission.check_backpressure(config, len(task.get("batch") or [task]))
+    if wait_minutes is not None:
+        try:
+            await update.message.reply_text(
+                f"⚠️ 系统繁忙，当前排队任务较多，预计需等待约 {wait_minutes} 分钟\n\n请稍后再发送此任务。"
+            )
+        except Exception as e:
+            logging.error(f"Failed to send busy message: {e}")
+        return
+    
+    # 依赖熔断时立即告知原因，而不是排队后等待 agent 超时
+    unavailable = health_monitor.check_task_dependencies()
+    if unavailable:
+        try:
+            await update.message.reply_text(
+                f"❌ 暂时无法执行任务：{unavailable}\n\n依赖恢复后会自动重新可用，可发送 /status 查看健康状态。"
+            )
+        except Exception as e:
+            logging.error(f"Failed to send dependency failure message: {e}")
+        return
+    
+    # 批量任务：并行执行所有子任务，汇总进度与结果（整条消息只计一次速率限制）
+    if task.get("batch"):
+        await execute_batch(update, task["batch"], user_id, username)
+        return
+    
+    # 相同任务重复提交（如网络重发）时合并到正在执行的任务，结果一并回复
+    dedup_key = admission.task_key(user_id, task)
+    duplicate = admission.find_duplicate(dedup_key, config)
+    if duplicate:
+        try:
+            await update.message.reply_text("🔁 相同任务正在执行中，已合并，完成后将一并回复结果")
+            merged_response = await admission.wait_for_merged(duplicate)
+            if merged_response:
+                await reply_in_chunks(update.message, merged_response)
+            else:
+                await update.message.reply_text("❌ 合并的原任务执行出错，请查看原任务的回复或重新发送")
+        except Exception as e:
+            logging.error(f"Failed to deliver merged result: {e}")
+        return
+    admission_entry = admission.register(dedup_key)
+    
+    # 7. 执行任务
+    ticket = None
+    response = None
     try:
+        # 先验证输入：会被拒绝的任务不占用调度名额，也不创建或续接 agent 对话
+        validate_task_input(task["description"])
+        
+        # 提交到调度队列（加权公平 + 优先级），必要时排队等待
+        priority = task_scheduler.resolve_priority(task.get("priority"), user_id)
+        ticket = task_scheduler.submit(user_id, priority)
+        position = task_scheduler.queue_position(ticket)
+        if ticket["started_at"] is None:
+            try:
+                await update.message.reply_text(
+                    f"🕒 任务已加入队列（优先级：{priority}，前面还有 {position} 个任务）"
+                )
+            except Exception as e:
+                logging.error(f"Failed to send 'queued' message: {e}")
+        await task_scheduler.wait_for_slot(ticket)
+        
+        # --model auto 时按历史延迟/成功率选择模型
+        model, route_reason = model_router.choose_model(
+            task["model"], task["projectPath"], task["description"], config, user_id
+        )
+        model_info = f"（模型：{model}，自动路由：{route_reason}）" if route_reason not in ("manual", "default") else ""
+        
+        # 根据历史耗时预测完成时间
+        eta = eta_predictor.predict(task["projectPath"], model, task["description"])
+        eta_info = f"\n🕐 {eta_predictor.format_eta(eta)}" if eta else ""
+        
+        # 同一（用户, 项目）的任务在同一个 agent 对话中继续
+        agent_chat_id, resumed = await resolve_agent_chat(user_id, task["projectPath"])
+        chat_info = "\n💬 继续之前的对话（发送 /new 开始新对话）" if resumed else ""
+        
         # 发送执行中消息
         status_message = None
         try:
-            status_message = await update.message.reply_text("⏳ 正在执行任务...")
+            status_message = await update.message.reply_text(f"⏳ 正在执行任务...{model_info}{eta_info}{chat_info}")
         except Exception as e:
             logging.error(f"Failed to send 'executing' message: {e}")
         
@@ -605,75 +960,42 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         async def progress_callback(incremental_output, elapsed_seconds):
             """进度回调：发送增量输出"""
             try:
-                elapsed_min = int(elapsed_seconds // 60)
-                elapsed_sec = int(elapsed_seconds % 60)
-                elapsed_str = f"{elapsed_min}分{elapsed_sec}秒"
-                
-                # 限制增量输出长度
-                max_incremental_length = 3000
-                if len(incremental_output) > max_incremental_length:
-                    incremental_output = incremental_output[:max_incremental_length] + "\n\n... (增量内容已截断)"
-                
-                progress_text = f"📊 进度更新（已执行 {elapsed_str}）\n\n{incremental_output}"
-                
-                # 发送增量更新
-                await update.message.reply_text(progress_text[:4096])
-                logging.info(f"Sent progress update to user {user_id} after {elapsed_str}")
+                await update.message.reply_text(format_progress_update(incremental_output, elapsed_seconds))
+                logging.info(f"Sent progress update to user {user_id} after {format_elapsed(elapsed_seconds)}")
             except Exception as e:
                 logging.error(f"Error sending progress update: {e}")
         
         result = await execute_cursor_cli(
             task["description"],
             task["projectPath"],
-            task["model"],
+            model,
             user_id,
             username,
-            progress_callback=progress_callback
+            progress_callback=progress_callback,
+            ticket=ticket,
+            eta=eta,
+            chat_id=update.effective_chat.id,
+            reply_to_message_id=update.message.message_id,
+            agent_chat_id=agent_chat_id,
+            on_spawned=lambda: update_backlog.mark_processed(update.update_id)
         )
         
         # 5. 发送结果
-        if result["success"]:
-            output_text = result.get('output', '')
-            if not output_text or not output_text.strip():
-                output_text = "任务执行成功，但无输出内容。"
-            
-            # 限制长度（Telegram 消息最大 4096 字符，留出标题空间）
-            max_length = 3500
-            if len(output_text) > max_length:
-                output_text = output_text[:max_length] + "\n\n... (内容已截断，完整内容请查看日志)"
-            
-            # 添加执行时间信息
-            duration_info = ""
-            if result.get('duration_ms', 0) > 0:
-                duration_sec = result['duration_ms'] / 1000
-                duration_info = f"\n⏱️ 执行时间: {duration_sec:.2f}秒"
-            
-            response = f"✅ 任务完成{duration_info}\n\n{output_text}"
-        else:
-            error_text = result.get('error', '未知错误')
-            if not error_text or not error_text.strip():
-                error_text = f"任务执行失败，退出码: {result.get('code', -1)}"
-            
-            if len(error_text) > 3500:
-                error_text = error_text[:3500] + "\n\n... (错误信息已截断)"
-            
-            response = f"❌ 任务失败 (code: {result.get('code', -1)})\n\n{error_text}"
+        response = format_task_response(result)
         
         # 发送消息（Telegram 限制 4096 字符）
         try:
-            await update.message.reply_text(response[:4096])
+            with profiler.span("send"):
+                await update.message.reply_text(response[:4096])
+            delivered = True
         except Exception as e:
             # 如果消息太长，分段发送
             logging.warning(f"Message too long, splitting: {e}")
-            chunks = [response[i:i+4000] for i in range(0, len(response), 4000)]
-            for i, chunk in enumerate(chunks):
-                try:
-                    if i == 0:
-                        await update.message.reply_text(chunk)
-                    else:
-                        await update.message.reply_text(f"(续) {chunk}")
-                except Exception as chunk_error:
-                    logging.error(f"Failed to send chunk {i}: {chunk_error}")
+            delivered = await reply_in_chunks(update.message, response)
+        
+        # 结果送达后才删除任务目录，否则保留到下次启动时补发
+        if delivered:
+            detached_tasks.remove_task(result["task_id"])
         
     except ValueError as e:
         # 输入验证失败
@@ -710,6 +1032,455 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
         except Exception as reply_error:
             logging.error(f"Failed to send error reply: {reply_error}")
+    finally:
+        if ticket:
+            task_scheduler.release(ticket)
+        admission.complete(admission_entry, response)
+
+def format_task_response(result):
+    """将 execute_cursor_cli() 的结果格式化为回复文本"""
+    if result["success"]:
+        output_text = result.get('output', '')
+        if not output_text or not output_text.strip():
+            output_text = "任务执行成功，但无输出内容。"
+        
+        # 限制长度（Telegram 消息最大 4096 字符，留出标题空间）
+        max_length = 3500
+        if len(output_text) > max_length:
+            output_text = output_text[:max_length] + "\n\n... (内容已截断，完整内容请查看日志)"
+        
+        # 添加执行时间信息
+        duration_info = ""
+        if result.get('duration_ms', 0) > 0:
+            duration_sec = result['duration_ms'] / 1000
+            duration_info = f"\n⏱️ 执行时间: {duration_sec:.2f}秒"
+        
+        usage_info = resource_limits.format_usage(result.get("usage"))
+        if usage_info:
+            duration_info += f"\n{usage_info}"
+        
+        response = f"✅ 任务完成{duration_info}\n\n{output_text}"
+    else:
+        error_text = result.get('error', '未知错误')
+        if not error_text or not error_text.strip():
+            error_text = f"任务执行失败，退出码: {result.get('code', -1)}"
+        
+        if len(error_text) > 3500:
+            error_text = error_text[:3500] + "\n\n... (错误信息已截断)"
+        
+        response = f"❌ 任务失败 (code: {result.get('code', -1)})\n\n{error_text}"
+        usage_info = resource_limits.format_usage(result.get("usage"))
+        if usage_info:
+            response += f"\n\n{usage_info}"
+    return response
+
+def format_progress_update(incremental_output, elapsed_seconds):
+    """格式化进度更新消息"""
+    # 限制增量输出长度
+    max_incremental_length = 3000
+    if len(incremental_output) > max_incremental_length:
+        incremental_output = incremental_output[:max_incremental_length] + "\n\n... (增量内容已截断)"
+    return f"📊 进度更新（已执行 {format_elapsed(elapsed_seconds)}）\n\n{incremental_output}"[:4096]
+
+async def send_in_chunks(bot, chat_id, text, reply_to_message_id=None, chunk_size=4000):
+    """按 Telegram 消息长度限制分段发送（无 Message 对象时使用，如重启后接管的任务），全部发送成功时返回 True"""
+    chunks = [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)] or [""]
+    delivered = True
+    for i, chunk in enumerate(chunks):
+        try:
+            await bot.send_message(
+                chat_id,
+                chunk if i == 0 else f"(续) {chunk}",
+                reply_to_message_id=reply_to_message_id,
+                allow_sending_without_reply=True
+            )
+        except Exception as e:
+            logging.error(f"Failed to send chunk {i} to chat {chat_id}: {e}")
+            delivered = False
+    return delivered
+
+async def resume_detached_task(bot, task):
+    """
+    接管 Bot 重启前启动的任务：从上次的偏移继续推送输出，结束后把结果发送到原聊天
+
+    Args:
+        bot: telegram.Bot
+        task: detached_tasks.load_pending_tasks() 返回的任务状态字典
+    """
+    chat_id = task.get("chat_id")
+    reply_to_message_id = task.get("reply_to_message_id")
+    logging.info(f"Adopting detached task {task['task_id']} of user {task.get('user_id')} (chat {chat_id})")
+    
+    async def progress_callback(incremental_output, elapsed_seconds):
+        if chat_id is None:
+            return
+        try:
+            await bot.send_message(
+                chat_id,
+                format_progress_update(incremental_output, elapsed_seconds),
+                reply_to_message_id=reply_to_message_id,
+                allow_sending_without_reply=True
+            )
+        except Exception as e:
+            logging.error(f"Error sending progress update: {e}")
+    
+    try:
+        # 重启前已结束、只是结果尚未送达的任务直接补发
+        result = task.get("result") or await follow_cursor_task(task, progress_callback=progress_callback, eta=task.get("eta"))
+        response = format_task_response(result)
+    except Exception as e:
+        logging.error(f"Failed to follow detached task {task['task_id']}: {e}", exc_info=True)
+        response = f"❌ 执行错误\n\n错误信息: {str(e)[:1000]}\n\n请查看日志文件获取详细信息。"
+    if chat_id is None:
+        logging.warning(f"Detached task {task['task_id']} has no chat to deliver its result to")
+        detached_tasks.remove_task(task["task_id"])
+        return
+    if await send_in_chunks(bot, chat_id, f"♻️ Bot 重启前提交的任务\n{response}", reply_to_message_id):
+        detached_tasks.remove_task(task["task_id"])
+
+def format_elapsed(seconds):
+    """将秒数格式化为 X分Y秒"""
+    seconds = max(int(seconds), 0)
+    return f"{seconds // 60}分{seconds % 60}秒"
+
+async def reply_in_chunks(message, text, chunk_size=4000):
+    """按 Telegram 消息长度限制分段回复，全部发送成功时返回 True"""
+    chunks = [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)] or [""]
+    delivered = True
+    for i, chunk in enumerate(chunks):
+        try:
+            await message.reply_text(chunk if i == 0 else f"(续) {chunk}")
+        except Exception as e:
+            logging.error(f"Failed to send chunk {i}: {e}")
+            delivered = False
+    return delivered
+
+async def execute_batch(update, items, user_id, username):
+    """
+    并行执行批量任务（受调度器并发上限约束，同一项目的子任务依次执行），
+    用一条消息汇总所有子任务的进度，结束后发送汇总表
+
+    Args:
+        update: Telegram Update
+        items: parse_task_message 返回的 batch 子任务列表
+        user_id: 用户ID
+        username: 用户名
+    """
+    # 同一项目的子任务共用一个工作区，按顺序执行以免互相冲突
+    project_locks = defaultdict(asyncio.Lock)
+    # 整个批量任务只占用户的一个并发名额，组内最多 max_batch_items 项同时执行
+    batch_group = uuid.uuid4().hex
+    batch_max_inflight = load_config().get("max_batch_items", MAX_BATCH_ITEMS)
+    # 重放的批量任务中，重启前已启动的子任务由 resume_detached_task() 单独回复结果
+    started_items = update_backlog.processed_items(update.update_id)
+    states = [
+        {"index": i, "item": item, "status": "queued", "elapsed": 0.0, "duration": None, "result": None, "error": "", "eta": None}
+        for i, item in enumerate(items)
+        if i not in started_items
+    ]
+    if not states:
+        return
+    status_icons = {"queued": "🕒", "running": "🔄", "paused": "⏸️", "success": "✅", "failed": "❌"}
+    status_message = None
+    last_refresh = [datetime.min]
+    
+    def item_label(item):
+        project_name = os.path.basename(item["projectPath"].rstrip("/")) or "默认项目"
+        return f"[{project_name}] {item['description'][:40]}"
+    
+    def render_progress():
+        lines = [f"📦 批量任务（共 {len(states)} 项）"]
+        for i, state in enumerate(states, 1):
+            line = f"{i}. {status_icons[state['status']]} {item_label(state['item'])}"
+            if state["duration"] is not None:
+                line += f"（{format_elapsed(state['duration'])}）"
+            elif state["status"] in ("running", "paused"):
+                line += f"（已执行 {format_elapsed(state['elapsed'])}"
+                if state["eta"]:
+                    line += f"，{eta_predictor.format_eta(state['eta'])}"
+                line += "）"
+                if eta_predictor.is_overdue(state["elapsed"], state["eta"]):
+                    line += " ⚠️ 可能已卡住"
+            lines.append(line)
+        return "\n".join(lines)
+    
+    async def refresh(force=False):
+        # 编辑同一条消息，非强制刷新时至少间隔 3 秒，避免触发 Telegram 频率限制
+        now = datetime.now()
+        if not status_message or (not force and now - last_refresh[0] < timedelta(seconds=3)):
+            return
+        last_refresh[0] = now
+        try:
+            await status_message.edit_text(render_progress()[:4096])
+        except Exception as e:
+            logging.debug(f"Failed to refresh batch progress: {e}")
+    
+    async def run_item(state):
+        async with project_locks[state["item"]["projectPath"]]:
+            await run_item_locked(state)
+    
+    async def run_item_locked(state):
+        ticket = None
+        start_time = None
+        try:
+            priority = task_scheduler.resolve_priority(state["item"].get("priority"), user_id)
+            ticket = task_scheduler.submit(user_id, priority, group=batch_group, group_max_inflight=batch_max_inflight)
+            await task_scheduler.wait_for_slot(ticket)
+            start_time = datetime.now()
+            state["model"], _ = model_router.choose_model(
+                state["item"]["model"], state["item"]["projectPath"], state["item"]["description"], load_config(), user_id
+            )
+            state["eta"] = eta_predictor.predict(state["item"]["projectPath"], state["model"], state["item"]["description"])
+            state["status"] = "running"
+            await refresh(force=True)
+            
+            async def progress_callback(incremental_output, elapsed_seconds):
+                state["elapsed"] = elapsed_seconds
+                state["status"] = "paused" if task_scheduler.is_suspended(ticket) else "running"
+                await refresh(force=True)
+            
+            result = await execute_cursor_cli(
+                state["item"]["description"],
+                state["item"]["projectPath"],
+                state["model"],
+                user_id,
+                username,
+                progress_callback=progress_callback,
+                ticket=ticket,
+                eta=state["eta"],
+                chat_id=update.effective_chat.id,
+                reply_to_message_id=update.message.message_id,
+                on_spawned=lambda: update_backlog.mark_processed(update.update_id, state["index"])
+            )
+            state["result"] = result
+            state["status"] = "success" if result["success"] else "failed"
+            state["error"] = result.get("error", "") or f"退出码: {result.get('code', -1)}"
+        except Exception as e:
+            logging.error(f"Batch item failed: {e}")
+            state["status"] = "failed"
+            state["error"] = str(e)[:1000]
+        finally:
+            if start_time:
+                state["duration"] = (datetime.now() - start_time).total_seconds() - task_scheduler.paused_seconds(ticket)
+            if ticket:
+                task_scheduler.release(ticket)
+            await refresh(force=True)
+    
+    logging.info(f"User {user_id} ({username}) submitted batch of {len(items)} tasks")
+    try:
+        status_message = await update.message.reply_text(render_progress())
+    except Exception as e:
+        logging.error(f"Failed to send batch progress message: {e}")
+    
+    await asyncio.gather(*(run_item(state) for state in states))
+    
+    # 汇总表 + 每项结果摘要
+    succeeded = sum(1 for state in states if state["status"] == "success")
+    lines = [f"📦 批量任务完成：成功 {succeeded}/{len(states)}", "", "# | 状态 | 耗时 | 任务"]
+    for i, state in enumerate(states, 1):
+        duration = format_elapsed(state["duration"]) if state["duration"] is not None else "-"
+        lines.append(f"{i} | {status_icons[state['status']]} | {duration} | {item_label(state['item'])}")
+    per_item_length = max(3000 // len(states), 200)
+    for i, state in enumerate(states, 1):
+        if state["status"] == "success":
+            detail = (state["result"].get("output") or "").strip() or "任务执行成功，但无输出内容。"
+        else:
+            detail = state["error"] or "未知错误"
+        if len(detail) > per_item_length:
+            detail = detail[:per_item_length] + "\n... (内容已截断)"
+        usage_info = resource_limits.format_usage((state["result"] or {}).get("usage"))
+        if usage_info:
+            detail += f"\n{usage_info}"
+        lines.append("")
+        lines.append(f"—— {i}. {item_label(state['item'])} ——")
+        lines.append(detail)
+    if await reply_in_chunks(update.message, "\n".join(lines)):
+        for state in states:
+            if state["result"]:
+                detached_tasks.remove_task(state["result"]["task_id"])
+
+async def handle_history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理 /history 命令：显示最近的任务及其资源使用"""
+    user_id = update.effective_user.id
+    if not update.message:
+        return
+    if not is_user_allowed(user_id):
+        logging.warning(f"Unauthorized /history attempt from user {user_id}")
+        return
+    records = task_history.get_user_history(user_id)
+    if not records:
+        text = "暂无任务记录"
+    else:
+        lines = ["🗂️ 最近的任务："]
+        for record in records:
+            status = "✅" if record.get("success") else f"❌ {record.get('killed_reason') or ''}".rstrip()
+            lines.append(
+                f"{record.get('time', '')} {status} {format_elapsed(record.get('wall_seconds', 0))} "
+                f"{record.get('description', '')[:40]}"
+            )
+            usage_info = resource_limits.format_usage(record.get("usage"))
+            if usage_info:
+                lines.append(f"    {usage_info}")
+        text = "\n".join(lines)
+    try:
+        await reply_in_chunks(update.message, text)
+    except Exception as e:
+        logging.error(f"Failed to send task history: {e}")
+
+async def handle_new_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理 /new 命令：结束当前项目的 agent 对话，下一条任务开始新对话"""
+    user_id = update.effective_user.id
+    if not update.message:
+        return
+    if not is_user_allowed(user_id):
+        logging.warning(f"Unauthorized /new attempt from user {user_id}")
+        return
+    user_project = get_user_project(user_id)
+    if not user_project:
+        text = "您还没有选择项目，请先发送触发词切换项目"
+    elif clear_agent_chat(user_id, user_project["project_path"]):
+        text = f"🆕 已结束项目 {user_project['trigger_word']} 的当前对话，下一条任务将开始新对话"
+    else:
+        text = f"项目 {user_project['trigger_word']} 还没有进行中的对话，下一条任务会开始新对话"
+    try:
+        await update.message.reply_text(text)
+    except Exception as e:
+        logging.error(f"Failed to send /new reply: {e}")
+
+def is_admin(user_id):
+    """检查用户是否为管理员（config 中的 admin_user_id）"""
+    admin_user_id = load_config().get("admin_user_id")
+    return admin_user_id is not None and user_id == admin_user_id
+
+async def _send_profile_report(message, report):
+    """将采样报告作为文件发送"""
+    filename = f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.txt"
+    try:
+        await message.reply_document(document=report.encode("utf-8"), filename=filename)
+    except Exception as e:
+        logging.error(f"Failed to send profile report: {e}")
+
+async def handle_profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理 /profile start [秒数] | stop 命令（仅管理员）"""
+    user_id = update.effective_user.id
+    if not update.message:
+        return
+    if not is_admin(user_id):
+        logging.warning(f"Non-admin /profile attempt from user {user_id}")
+        return
+    
+    config = load_config()
+    settings = profiler.get_profiling_settings(config)
+    args = context.args or []
+    action = args[0].lower() if args else ""
+    
+    if action == "start":
+        try:
+            seconds = int(args[1]) if len(args) > 1 else 30
+        except ValueError:
+            await update.message.reply_text("❌ 用法：/profile start [秒数]")
+            return
+        seconds = max(1, min(seconds, settings["max_profile_seconds"]))
+        if not profiler.start_profiling(config):
+            await update.message.reply_text("⚠️ 采样分析已在运行，发送 /profile stop 结束")
+            return
+        await update.message.reply_text(f"🔬 已开始采样分析，{seconds} 秒后自动发送结果")
+        
+        async def auto_stop():
+            await asyncio.sleep(seconds)
+            report = profiler.stop_profiling()
+            if report:
+                await _send_profile_report(update.message, report)
+        
+        context.application.bot_data["profile_task"] = asyncio.create_task(auto_stop())
+    elif action == "stop":
+        auto_stop_task = context.application.bot_data.pop("profile_task", None)
+        if auto_stop_task:
+            auto_stop_task.cancel()
+        report = profiler.stop_profiling()
+        if not report:
+            await update.message.reply_text("⚠️ 采样分析未在运行")
+            return
+        await _send_profile_report(update.message, report)
+    else:
+        loop_stats = profiler.get_loop_stats()
+        await update.message.reply_text(
+            f"用法：/profile start [秒数] | /profile stop\n\n"
+            f"事件循环最大延迟：{loop_stats['max_lag_ms']:.0f}ms，卡顿次数：{loop_stats['stalls']}\n\n"
+            f"处理阶段耗时（次数 / 平均ms / 最大ms）：\n{profiler.format_span_stats()}"
+        )
+
+async def handle_status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理 /status 命令：显示当前项目与所有项目的缓存状态"""
+    user_id = update.effective_user.id
+    if not update.message:
+        return
+    if not is_user_allowed(user_id):
+        logging.warning(f"Unauthorized /status attempt from user {user_id}")
+        return
+    user_project = get_user_project(user_id)
+    if user_project:
+        current = f"📌 当前项目：{user_project['trigger_word']}（{user_project['project_path']}）"
+    else:
+        current = "📌 当前未选择项目"
+    projects = project_index.format_all_project_status() or "（未配置 project_trigger_mapping）"
+    text = f"{current}\n\n📂 项目状态：\n{projects}"
+    text += f"\n\n🩺 依赖健康：\n{health_monitor.format_health_status()}"
+    backlog_report = update_backlog.format_backlog_report()
+    if backlog_report:
+        text += f"\n\n{backlog_report}"
+    routing_stats = model_router.format_routing_stats()
+    if routing_stats:
+        text += f"\n\n🤖 模型统计：\n{routing_stats}"
+    try:
+        await reply_in_chunks(update.message, text)
+    except Exception as e:
+        logging.error(f"Failed to send status: {e}")
+
+async def record_update_offset(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """持久化最后收到的 update_id，重启后从此处拉取积压（已收到但未执行的消息由 handle_message 记录）"""
+    update_backlog.save_offset(update.update_id)
+
+def find_switch_project(message_text):
+    """消息为项目切换时返回项目路径，否则返回 None"""
+    trigger_result = extract_trigger_from_message(message_text, trigger_mapping)
+    return trigger_result[1] if trigger_result else None
+
+# 重启后接管的任务（保留引用，避免被垃圾回收）
+_adopted_tasks = set()
+
+async def post_init(application):
+    """Bot 启动后、开始轮询前执行的初始化"""
+    config = load_config()
+    profiler.start_loop_monitor(config)
+    history = task_history.load_task_history()
+    model_router.warm_up(history, config)
+    eta_predictor.warm_up([record for record in history if record.get("success")])
+    # 接管重启前仍在运行（或已结束但未回复）的任务
+    for task in detached_tasks.load_pending_tasks():
+        detached_tasks.resume_process_group(task)
+        adopted = asyncio.create_task(resume_detached_task(application.bot, task))
+        _adopted_tasks.add(adopted)
+        adopted.add_done_callback(_adopted_tasks.discard)
+    # 处理离线期间的积压消息（替代 drop_pending_updates）
+    await update_backlog.drain_backlog(application, config, find_switch_project)
+    project_index.start_project_index(PROJECT_TRIGGER_MAPPING, config)
+    health_monitor.start_health_monitor(
+        config, AGENT_PATH, build_agent_env()["HTTPS_PROXY"], PROXY_URL if USE_PROXY else None
+    )
+
+async def handle_queue_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理 /queue 命令：显示任务队列与每用户公平性/等待统计"""
+    user_id = update.effective_user.id
+    if not update.message:
+        return
+    if not is_user_allowed(user_id):
+        logging.warning(f"Unauthorized /queue attempt from user {user_id}")
+        return
+    try:
+        await update.message.reply_text(task_scheduler.format_scheduler_stats())
+    except Exception as e:
+        logging.error(f"Failed to send queue stats: {e}")
 
 def main():
     """主函数"""
@@ -728,15 +1499,29 @@ def main():
         os.environ.pop('HTTPS_PROXY', None)
         logging.info("Proxy disabled")
     
+    # 初始化任务调度器
+    task_scheduler.configure(load_config())
+    
     # 创建应用（库会自动读取 HTTP_PROXY/HTTPS_PROXY 环境变量）
-    app = Application.builder().token(BOT_TOKEN).build()
+    # 开启并发处理，使排队中的任务不会阻塞其他用户的消息
+    app = Application.builder().token(BOT_TOKEN).concurrent_updates(True).post_init(post_init).build()
+    
+    # 记录 update_id（group -1 先于其他处理器执行，且不影响后续处理）
+    app.add_handler(TypeHandler(Update, record_update_offset), group=-1)
+    
+    # 添加命令处理器（需在文本消息处理器之前注册）
+    app.add_handler(CommandHandler("queue", handle_queue_command))
+    app.add_handler(CommandHandler("history", handle_history_command))
+    app.add_handler(CommandHandler("profile", handle_profile_command))
+    app.add_handler(CommandHandler("status", handle_status_command))
+    app.add_handler(CommandHandler("new", handle_new_command))
     
     # 添加消息处理器（处理所有文本消息）
     app.add_handler(MessageHandler(filters.TEXT, handle_message))
     
     logging.info("Bot started, waiting for messages...")
     logging.info(f"Current proxy env: HTTP_PROXY={os.environ.get('HTTP_PROXY', 'None')}")
-    app.run_polling(drop_pending_updates=True)
+    app.run_polling()
 
 if __name__ == "__main__":
     main()
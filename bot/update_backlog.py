@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+更新偏移量持久化与积压消息处理模块
+记录最后收到的 update_id，以及已收到但尚未交给 agent（仍在排队、等待合并或创建对话）
+的任务消息；启动时重放这些消息，并分批拉取 Bot 离线期间的积压消息，
+合并重复提交、跳过过期消息，并先处理项目切换与命令再处理任务。
+"""
+
+import os
+import re
+import json
+import time
+import logging
+from datetime import datetime, timezone, timedelta
+from threading import Lock
+
+from telegram import Update
+from telegram.error import TelegramError
+
+from session_manager import get_user_project
+
+# 数据文件路径
+DATA_DIR = os.path.join(os.path.dirname(__file__), "../data")
+OFFSET_FILE = os.path.join(DATA_DIR, "update_offset.json")
+PENDING_FILE = os.path.join(DATA_DIR, "pending_updates.json")
+
+# 默认积压处理配置（可被 config/bot_config.json 的 backlog 段覆盖）
+DEFAULT_BACKLOG_CONFIG = {
+    "max_age_seconds": 900,
+    "batch_size": 100
+}
+
+# 文件锁，用于多线程安全
+_file_lock = Lock()
+
+_last_saved = None
+_pending = None  # str(update_id) -> {"update": Update.to_dict(), "done_items": [...]}，首次使用时从文件加载
+_backlog_update_ids = set()  # 来自积压的 update_id（不计入速率限制）
+_pinned_projects = {}  # update_id -> 积压中该消息发送时所在的项目路径
+_report = {}
+
+
+def ensure_data_dir():
+    """确保数据目录存在"""
+    if not os.path.exists(DATA_DIR):
+        os.makedirs(DATA_DIR, exist_ok=True)
+
+
+def load_offset():
+    """
+    读取最后处理的 update_id
+
+    Returns:
+        int: update_id；从未记录时返回 None
+    """
+    if not os.path.exists(OFFSET_FILE):
+        return None
+    try:
+        with _file_lock:
+            with open(OFFSET_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f).get("last_update_id")
+    except (json.JSONDecodeError, IOError) as e:
+        logging.error(f"Failed to load update offset: {e}")
+        return None
+
+
+def save_offset(update_id):
+    """记录最后收到的 update_id（只增不减，原子写入）"""
+    global _last_saved
+    if _last_saved is not None and update_id <= _last_saved:
+        return
+    ensure_data_dir()
+    tmp_file = OFFSET_FILE + ".tmp"
+    try:
+        with _file_lock:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({"last_update_id": update_id}, f)
+            os.replace(tmp_file, OFFSET_FILE)
+        _last_saved = update_id
+    except IOError as e:
+        logging.error(f"Failed to save update offset: {e}")
+
+
+def _load_pending():
+    global _pending
+    if _pending is not None:
+        return _pending
+    _pending = {}
+    if os.path.exists(PENDING_FILE):
+        try:
+            with _file_lock:
+                with open(PENDING_FILE, 'r', encoding='utf-8') as f:
+                    _pending = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            logging.error(f"Failed to load pending updates: {e}")
+    return _pending
+
+
+def _save_pending():
+    ensure_data_dir()
+    tmp_file = PENDING_FILE + ".tmp"
+    try:
+        with _file_lock:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(_pending, f, ensure_ascii=False)
+            os.replace(tmp_file, PENDING_FILE)
+    except IOError as e:
+        logging.error(f"Failed to save pending updates: {e}")
+
+
+def track_update(update):
+    """
+    记录收到的任务消息，直到它交给 agent 或已回复拒绝（见 mark_processed()）
+
+    Telegram 在轮询时即确认消息，仅靠 update_id 无法找回收到后、执行前 Bot 就重启的消息，
+    因此把消息本身保存下来，启动时重放。
+    """
+    pending = _load_pending()
+    key = str(update.update_id)
+    if key not in pending:
+        pending[key] = {"update": update.to_dict(), "done_items": []}
+        _save_pending()
+
+
+def mark_processed(update_id, item=None):
+    """
+    标记消息已处理（已启动 agent 或已回复）
+
+    Args:
+        update_id: 消息的 update_id
+        item: 批量任务中已启动的子任务序号；为 None 时整条消息处理完毕
+    """
+    pending = _load_pending()
+    key = str(update_id)
+    if key not in pending:
+        return
+    if item is None:
+        del pending[key]
+    elif item not in pending[key]["done_items"]:
+        pending[key]["done_items"].append(item)
+    _save_pending()
+
+
+def processed_items(update_id):
+    """重放的批量任务中重启前已启动的子任务序号（这些子任务由 detached_tasks 接管）"""
+    entry = _load_pending().get(str(update_id))
+    return set(entry["done_items"]) if entry else set()
+
+
+def load_pending_updates(bot):
+    """
+    读取重启前已收到但未处理完的消息
+
+    Returns:
+        list: Update 列表，按 update_id 排序
+    """
+    updates = []
+    for key, entry in list(_load_pending().items()):
+        try:
+            updates.append(Update.de_json(entry["update"], bot))
+        except (KeyError, TypeError, ValueError) as e:
+            logging.warning(f"Discarding unreadable pending update {key}: {e}")
+            del _pending[key]
+    return sorted(updates, key=lambda update: update.update_id)
+
+
+def is_backlog_update(update_id):
+    """是否为启动时从积压中恢复的消息"""
+    return update_id in _backlog_update_ids
+
+
+def pop_pinned_project(update_id):
+    """取出积压消息发送时所在的项目路径（没有固定项目时返回 None）"""
+    return _pinned_projects.pop(update_id, None)
+
+
+def get_backlog_report():
+    """返回最近一次积压处理的统计"""
+    return dict(_report)
+
+
+def _normalize(text):
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def _is_command(message):
+    """消息是否为 Bot 命令（/new、/status 等）"""
+    return message.text.startswith("/") or any(
+        entity.type == "bot_command" and entity.offset == 0 for entity in message.entities or ()
+    )
+
+
+def plan_backlog(updates, find_switch_project, max_age_seconds, now=None):
+    """
+    整理积压消息的处理顺序
+
+    Args:
+        updates: 按 update_id 排序的 Update 列表
+        find_switch_project: 函数，参数为消息文本，是项目切换时返回项目路径，否则返回 None
+        max_age_seconds: 超过此时长的消息视为过期
+        now: 当前时间（UTC，可选）
+
+    项目切换与命令按原顺序最先处理（/new 等命令作用于发送时所在的项目），
+    命令不合并、不固定项目；任务随后处理并固定在发送时所在的项目。
+
+    Returns:
+        tuple: (ordered_updates, stale_updates, collapsed_updates)
+    """
+    now = now or datetime.now(timezone.utc)
+    max_age = timedelta(seconds=max_age_seconds)
+    controls, tasks, others, stale = [], [], [], []
+    seen = set()
+    collapsed = []
+    current_project = {}  # user_id -> 积压中当前所在的项目路径
+
+    for update in updates:
+        message = update.message
+        if not message or not message.text or not update.effective_user:
+            others.append(update)
+            continue
+        if message.date and now - message.date > max_age:
+            stale.append(update)
+            continue
+        user_id = update.effective_user.id
+        text = message.text
+        if user_id not in current_project:
+            session = get_user_project(user_id)
+            current_project[user_id] = session["project_path"] if session else None
+
+        if _is_command(message):
+            controls.append(update)
+            continue
+        switch_path = find_switch_project(text)
+        if switch_path is not None:
+            current_project[user_id] = switch_path
+            controls.append(update)
+            continue
+
+        # 同一内容在不同项目下是不同的任务（显式 --project 已包含在文本中）
+        project = None if "--project" in text.lower() else current_project[user_id]
+        key = (user_id, project, _normalize(text))
+        if key in seen:
+            collapsed.append(update)
+            continue
+        seen.add(key)
+        # 切换会先于任务处理，因此把任务固定在它发送时所在的项目
+        if current_project[user_id] and "--project" not in text.lower():
+            _pinned_projects[update.update_id] = current_project[user_id]
+        tasks.append(update)
+
+    return controls + others + tasks, stale, collapsed
+
+
+async def drain_backlog(application, config, find_switch_project):
+    """
+    重放重启前未处理完的消息，并分批拉取、处理离线期间的积压消息
+
+    Args:
+        application: telegram.ext.Application（已初始化，尚未开始轮询）
+        config: load_config() 返回的配置字典
+        find_switch_project: 见 plan_backlog()
+    """
+    settings = dict(DEFAULT_BACKLOG_CONFIG)
+    settings.update(config.get("backlog") or {})
+    last_update_id = load_offset()
+    offset = last_update_id + 1 if last_update_id is not None else None
+
+    started = time.monotonic()
+    pending = load_pending_updates(application.bot)
+    updates = []
+    batches = 0
+    while True:
+        try:
+            batch = await application.bot.get_updates(offset=offset, limit=settings["batch_size"], timeout=0)
+        except TelegramError as e:
+            # 如仍设置了 webhook、另一个实例在轮询或网络故障：不阻止启动，剩余消息交给正常轮询
+            logging.error(f"Failed to fetch backlog, continuing with normal polling: {e}")
+            break
+        if not batch:
+            break
+        batches += 1
+        updates.extend(batch)
+        offset = batch[-1].update_id + 1
+
+    fetched_ids = {update.update_id for update in updates}
+    replayed = [update for update in pending if update.update_id not in fetched_ids]
+    ordered, stale, collapsed = plan_backlog(
+        sorted(updates + replayed, key=lambda update: update.update_id),
+        find_switch_project,
+        settings["max_age_seconds"]
+    )
+    allowed_user_ids = config.get("allowed_user_ids", [])
+    for update in stale:
+        if update.effective_user and update.effective_user.id in allowed_user_ids:
+            try:
+                await update.message.reply_text(
+                    f"⏭️ 这条消息在 Bot 离线期间发送，已超过 {settings['max_age_seconds'] // 60} 分钟，已跳过。\n如仍需执行请重新发送。"
+                )
+            except Exception as e:
+                logging.error(f"Failed to notify skipped backlog message: {e}")
+        mark_processed(update.update_id)
+    for update in collapsed:
+        if update.effective_user and update.effective_user.id in allowed_user_ids:
+            try:
+                await update.message.reply_text(
+                    "🔁 这条消息与 Bot 离线期间发送的另一条相同任务重复，已合并，只执行一次。"
+                )
+            except Exception as e:
+                logging.error(f"Failed to notify collapsed backlog message: {e}")
+        mark_processed(update.update_id)
+    for update in ordered:
+        _backlog_update_ids.add(update.update_id)
+        await application.update_queue.put(update)
+    if updates:
+        save_offset(updates[-1].update_id)
+
+    elapsed = time.monotonic() - started
+    _report.update({
+        "fetched": len(updates),
+        "replayed": len(replayed),
+        "batches": batches,
+        "queued": len(ordered),
+        "stale_skipped": len(stale),
+        "duplicates_collapsed": len(collapsed),
+        "seconds": round(elapsed, 3),
+        "updates_per_second": round(len(updates) / elapsed, 1) if elapsed > 0 else 0.0
+    })
+    logging.info(
+        f"Backlog drained: {len(updates)} updates in {batches} batches, {len(replayed)} replayed, {elapsed:.2f}s "
+        f"({_report['updates_per_second']}/s), {len(stale)} stale skipped, {len(collapsed)} duplicates collapsed"
+    )
+
+
+def format_backlog_report():
+    """格式化积压处理统计，用于 /status"""
+    if not _report or not (_report.get("fetched") or _report.get("replayed")):
+        return ""
+    return (
+        f"📥 启动时积压：{_report['fetched']} 条（{_report['batches']} 批，{_report['seconds']}秒，"
+        f"{_report['updates_per_second']} 条/秒），重放重启前未执行的消息 {_report['replayed']} 条，"
+        f"跳过过期 {_report['stale_skipped']} 条，合并重复 {_report['duplicates_collapsed']} 条"
+    )
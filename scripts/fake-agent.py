@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+用于测试的假 agent
+模拟 Cursor CLI 的 create-chat、--resume 与 -p 调用，并把每次调用（包括收到的对话ID）
+以 JSON 行追加到 FAKE_AGENT_LOG（默认 /tmp/fake-agent.jsonl），便于检查 Bot 是否正确续接对话。
+
+用法：
+    CURSOR_AGENT_PATH=scripts/fake-agent.py FAKE_AGENT_LOG=/tmp/fake-agent.jsonl python3 bot/telegram-bot.py
+
+环境变量：
+    FAKE_AGENT_LOG    调用记录文件
+    FAKE_AGENT_DELAY  每个任务模拟执行的秒数（默认 1）
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+
+LOG_FILE = os.getenv("FAKE_AGENT_LOG", "/tmp/fake-agent.jsonl")
+
+
+def load_records():
+    if not os.path.exists(LOG_FILE):
+        return []
+    with open(LOG_FILE, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_record(record):
+    record["time"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    record["cwd"] = os.getcwd()
+    with open(LOG_FILE, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def main():
+    args = sys.argv[1:]
+    if args == ["--version"]:
+        print("fake-agent 0.0.0")
+        return
+    if args[:1] == ["create-chat"]:
+        chat_id = str(uuid.uuid4())
+        append_record({"command": "create-chat", "chat_id": chat_id})
+        print(chat_id)
+        return
+
+    resume = None
+    if "--resume" in args:
+        resume = args[args.index("--resume") + 1]
+    model = args[args.index("--model") + 1] if "--model" in args else None
+    task = args[-1] if args else ""
+    append_record({"command": "task", "resume": resume, "model": model, "task": task})
+
+    # 只认 create-chat 创建过的对话，模拟对话失效
+    known_chats = {record.get("chat_id") for record in load_records() if record.get("command") == "create-chat"}
+    if resume and resume not in known_chats:
+        print(f"Error: chat {resume} not found", file=sys.stderr)
+        sys.exit(1)
+
+    previous_turns = sum(1 for record in load_records() if resume and record.get("resume") == resume) - 1
+    print(f"working on: {task}", flush=True)
+    time.sleep(float(os.getenv("FAKE_AGENT_DELAY", "1")))
+    print(json.dumps({
+        "type": "result",
+        "is_error": False,
+        "result": f"fake result for: {task} (chat {resume or 'none'}, previous turns {max(previous_turns, 0)})",
+        "duration_ms": 1000,
+        "duration_api_ms": 800
+    }))
+
+
+if __name__ == "__main__":
+    main()